@@ -0,0 +1,76 @@
+"""
+Frame handoff latency through the shared-memory frame bus, between a writer
+process and a reader process, for 1080p JPEG and raw BGR frames.
+
+    python benchmarks/framebus_bench.py [frames]
+"""
+import os
+import struct
+import sys
+import time
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framebus import FrameBus, KIND_BGR, KIND_JPEG
+
+SIZES = {
+    "1080p jpeg": (KIND_JPEG, 400 * 1024),
+    "1080p bgr": (KIND_BGR, 1920 * 1080 * 3),
+}
+
+
+def reader(name, frames, results):
+    bus = FrameBus(name)
+    latencies = []
+    seq = 1
+    while seq <= frames:
+        seq = bus.wait_for_frame(seq, timeout=5, poll_interval=0)
+        if seq is None:
+            break
+        received = time.perf_counter_ns()
+        frame = bus.read(seq)
+        if frame is not None:
+            payload = frame[5]
+            sent = struct.unpack_from('<Q', payload)[0]
+            if bus.is_current(seq):
+                latencies.append(received - sent)
+            payload.release()
+        seq += 1
+    bus.close()
+    results.put(latencies)
+
+
+def run(label, kind, size, frames):
+    name = f"framebus-bench-{os.getpid()}"
+    bus = FrameBus(name, slots=8, slot_size=size, create=True)
+    data = bytearray(os.urandom(size))
+    results = Queue()
+    process = Process(target=reader, args=(name, frames, results))
+    process.start()
+    time.sleep(0.5)
+
+    writes = []
+    for seq in range(1, frames + 1):
+        start = time.perf_counter_ns()
+        struct.pack_into('<Q', data, 0, start)
+        bus.write(seq, data, kind, 1920, 1080, 3)
+        writes.append(time.perf_counter_ns() - start)
+        # Pace the writer at 50 fps, like the capture thread
+        time.sleep(0.02)
+
+    latencies = sorted(results.get())
+    process.join()
+    bus.close()
+
+    writes.sort()
+    print(f"{label:12} {size / 1024:8.0f} KiB  write p50 {writes[len(writes) // 2] / 1000:8.1f} us"
+          f"  handoff p50 {latencies[len(latencies) // 2] / 1000:8.1f} us"
+          f"  p99 {latencies[int(len(latencies) * 0.99)] / 1000:8.1f} us"
+          f"  ({len(latencies)}/{frames} frames)")
+
+
+if __name__ == '__main__':
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for label, (kind, size) in SIZES.items():
+        run(label, kind, size, frames)
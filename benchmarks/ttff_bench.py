@@ -0,0 +1,64 @@
+"""
+Time to first byte (response headers) and time to first frame (first
+complete jpeg part) of new MJPEG viewers of a running server.
+
+    python benchmarks/ttff_bench.py http://127.0.0.1:5000/ [viewers]
+"""
+import re
+import socket
+import sys
+import time
+from urllib.parse import urlsplit
+
+PART_LENGTH = re.compile(rb'--frame\r\n.*?Content-Length: (\d+)\r\n\r\n', re.S)
+
+
+def connect(url, timeout=10):
+    """
+    Open one viewer connection and return (ttfb, ttff) in seconds.
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    start = time.perf_counter()
+    sock = socket.create_connection((parts.hostname, parts.port or 80), timeout=timeout)
+    try:
+        sock.sendall(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n\r\n'.encode())
+        data = b''
+        ttfb = None
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Connection closed before the first frame")
+            data += chunk
+            if ttfb is None and b'\r\n\r\n' in data:
+                ttfb = time.perf_counter() - start
+
+            match = PART_LENGTH.search(data)
+            if match and int(match.group(1)) and len(data) >= match.end() + int(match.group(1)):
+                return ttfb, time.perf_counter() - start
+    finally:
+        sock.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:5000/'
+    viewers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    results = []
+    for _ in range(viewers):
+        results.append(connect(url))
+        # New viewers arrive one after the other, not as a burst
+        time.sleep(0.2)
+
+    for label, values in (('ttfb', [r[0] for r in results]), ('ttff', [r[1] for r in results])):
+        print(f"{label}  p50 {percentile(values, 0.5) * 1000:7.1f} ms"
+              f"  p90 {percentile(values, 0.9) * 1000:7.1f} ms"
+              f"  max {max(values) * 1000:7.1f} ms")
@@ -0,0 +1,60 @@
+from threadedCamera import ThreadedCamera
+from viewers import ViewerRegistry
+from flv_relay import FlvRelay
+from hls_segmenter import HlsSegmenter
+
+
+class Channel:
+    """
+    Capture pipeline of one TikTok room: the MJPEG capture, the FLV relay
+    and the HLS segmenter enabled by the configured modes, plus the
+    registry of the viewers watching it.
+    """
+
+    def __init__(self, tiktok, settings=None):
+        settings = settings or {}
+        self.tiktok = tiktok
+        self.name = tiktok.user
+        self.logger = tiktok.logger
+        self.modes = settings.get('modes') or ['mjpeg']
+        self.renditions = settings.get('renditions')
+        self.hls = settings.get('hls') or {}
+        self.idle_timeout = settings.get('idle_timeout')
+        self.stall_timeout = settings.get('stall_timeout', 5)
+        self.viewers = ViewerRegistry(settings.get('viewer_timeout', 10))
+
+        self.camera = None
+        self.relay = None
+        self.segmenter = None
+
+    def start(self):
+        if 'mjpeg' in self.modes:
+            # The capture starts with the first viewer and hibernates when idle
+            self.camera = ThreadedCamera(self.tiktok.cached_live_url, self.renditions,
+                                         lazy=True, idle_timeout=self.idle_timeout,
+                                         stall_timeout=self.stall_timeout, logger=self.logger)
+
+        if 'flv' in self.modes or 'hls' in self.modes:
+            # Passthrough: the upstream FLV is relayed as-is, nothing is decoded
+            self.relay = FlvRelay(self.tiktok.cached_live_url, self.tiktok.httpclient, logger=self.logger).start()
+
+        if 'hls' in self.modes:
+            self.segmenter = HlsSegmenter(self.relay, logger=self.logger, **self.hls).start()
+        return self
+
+    def stop(self):
+        if self.camera is not None:
+            self.camera.stop()
+        if self.segmenter is not None:
+            self.segmenter.stop()
+        if self.relay is not None:
+            self.relay.stop()
+        if self.tiktok.cache is not None:
+            # The live ended, its pull url is not refreshed in the background anymore
+            self.tiktok.cache.unwatch(self.tiktok.room_id)
+
+    def stats(self):
+        stats = {'room_id': self.tiktok.room_id, 'modes': self.modes, 'viewers': self.viewers.stats()}
+        if self.camera is not None:
+            stats['camera'] = self.camera.stats()
+        return stats
@@ -0,0 +1,216 @@
+import logging
+import random
+from collections import deque
+from itertools import islice
+from threading import Thread, Condition
+
+FLV_HEADER_SIZE = 9
+TAG_HEADER_SIZE = 11
+PREVIOUS_TAG_SIZE = 4
+
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+
+CODEC_AVC = 7
+CODEC_HEVC = 12
+SOUND_AAC = 10
+
+# Tags yielded at once, a scatter-gather write takes at most IOV_MAX (1024) buffers
+MAX_TAGS_PER_WRITE = 512
+
+
+class FlvRelay(object):
+    """
+    Decode-free relay of an upstream FLV stream.
+    One upstream connection is opened and its tags are fanned out as-is to
+    every connected client. The sequence headers and the tags since the
+    latest keyframe (the GOP cache) are kept so a new client starts on a
+    keyframe immediately.
+    A dropped upstream is reopened with exponential backoff, the clients
+    stay connected and the caches are kept across the reconnect.
+    """
+
+    def __init__(self, src, session, ring_size=2048, read_timeout=10, max_backoff=30, logger=None):
+        self.logger = logger or logging.getLogger('logger')
+        # src is either the stream url, or a callable(refresh) returning it,
+        # called with refresh=True on every reconnect
+        self.src = src
+        self.session = session
+        self.read_timeout = read_timeout
+        self.max_backoff = max_backoff
+        self.response = None
+        self.running = False
+        self.reconnects = 0
+
+        # FLV file header and codec configuration every client needs first
+        self.header = b''
+        self.metadata = b''
+        self.video_config = b''
+        self.audio_config = b''
+
+        # Tags since the latest keyframe, and a ring of the recent tags by sequence number
+        self.gop = []
+        self.gop_seq = 0
+        self.tags = deque(maxlen=ring_size)
+        self.tag_seq = 0
+        self.condition = Condition()
+
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.response is not None:
+            self.response.close()
+        with self.condition:
+            self.condition.notify_all()
+
+    def update(self):
+        backoff = 1
+        refresh = False
+        try:
+            while self.running:
+                tag_seq = self.tag_seq
+                try:
+                    self.relay(refresh)
+                except Exception as ex:
+                    if self.running:
+                        self.logger.error(f"FlvRelay: upstream lost ({ex}), reconnecting")
+                if not self.running:
+                    break
+
+                # A connection that relayed tags was a working one, start over
+                backoff = 1 if self.tag_seq > tag_seq else min(backoff * 2, self.max_backoff)
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, backoff + random.uniform(0, backoff / 2))
+                refresh = True
+                self.reconnects += 1
+        finally:
+            self.running = False
+            with self.condition:
+                self.condition.notify_all()
+
+    def relay(self, refresh=False):
+        """
+        Relay the tags of one upstream connection until it ends.
+        """
+        if self.response is not None:
+            self.response.close()
+        src = self.src(refresh) if callable(self.src) else self.src
+        self.response = self.session.get(src, stream=True, timeout=self.read_timeout)
+        self.response.raise_for_status()
+        stream = self.response.raw
+
+        header = self.read_exact(stream, FLV_HEADER_SIZE + PREVIOUS_TAG_SIZE)
+        if header[:3] != b'FLV':
+            raise ValueError("Upstream is not an FLV stream")
+        self.header = header
+
+        while self.running:
+            tag_header = self.read_exact(stream, TAG_HEADER_SIZE)
+            data_size = int.from_bytes(tag_header[1:4], 'big')
+            body = self.read_exact(stream, data_size + PREVIOUS_TAG_SIZE)
+            self.publish(tag_header[0] & 0x1F, tag_header + body, body)
+
+    @staticmethod
+    def read_exact(stream, size):
+        data = stream.read(size)
+        while len(data) < size:
+            more = stream.read(size - len(data))
+            if not more:
+                raise EOFError("Upstream closed the connection")
+            data += more
+        return data
+
+    def publish(self, tag_type, tag, body):
+        """
+        Route a tag to the codec configuration or to the GOP cache, then
+        append it to the ring and wake up the clients.
+        """
+        with self.condition:
+            if tag_type == TAG_SCRIPT:
+                self.metadata = tag
+                return
+
+            if tag_type == TAG_VIDEO and body:
+                codec_id = body[0] & 0x0F
+                is_keyframe = body[0] >> 4 == 1
+                if codec_id in (CODEC_AVC, CODEC_HEVC) and len(body) > 1 and body[1] == 0:
+                    self.video_config = tag
+                    return
+                if is_keyframe:
+                    self.gop = []
+                    self.gop_seq = self.tag_seq + 1
+
+            if tag_type == TAG_AUDIO and len(body) > 1 and body[0] >> 4 == SOUND_AAC and body[1] == 0:
+                self.audio_config = tag
+                return
+
+            self.tag_seq += 1
+            self.tags.append((self.tag_seq, tag))
+            if self.gop_seq:
+                self.gop.append(tag)
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Return (sequence number, buffers) a new client has to write first:
+        the FLV header, the codec configuration and the GOP cache.
+        Blocks until the first keyframe is received, returns (0, []) on timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.gop or not self.running, timeout) or not self.gop:
+                return 0, []
+            buffers = [self.header, self.metadata, self.video_config, self.audio_config] + self.gop
+            return self.tag_seq, [buf for buf in buffers if buf]
+
+    def wait_for_tags(self, after_seq, timeout=None):
+        """
+        Block until tags newer than after_seq are published and return
+        (latest sequence number, tags). A client that fell out of the ring
+        is resynchronised on the GOP cache. Returns (after_seq, []) on timeout.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.tag_seq > after_seq or not self.running, timeout)
+            if self.tag_seq <= after_seq:
+                return after_seq, []
+            if not self.tags or self.tags[0][0] > after_seq + 1:
+                return self.tag_seq, list(self.gop)
+            start = len(self.tags) - (self.tag_seq - after_seq)
+            return self.tag_seq, [tag for _, tag in islice(self.tags, start, None)]
+
+
+def batches(tags, scatter_gather):
+    """
+    Split tags into the items of a response body. The GOP cache and the share
+    of the ring a lagging client gets run to thousands of tags, every batch
+    is written by the server as one scatter-gather write.
+    """
+    for start in range(0, len(tags), MAX_TAGS_PER_WRITE):
+        batch = tags[start:start + MAX_TAGS_PER_WRITE]
+        yield batch if scatter_gather else b''.join(batch)
+
+
+def generate_flv(relay, timeout=5, scatter_gather=True):
+    """
+    Stream the relayed FLV to a client, starting on the cached keyframe.
+    Yields lists of at most MAX_TAGS_PER_WRITE tags, joined into bytes
+    without scatter_gather.
+    """
+    try:
+        buffers = None
+        while not buffers and relay.running:
+            seq, buffers = relay.join(timeout)
+        if buffers:
+            yield from batches(buffers, scatter_gather)
+        while relay.running:
+            seq, tags = relay.wait_for_tags(seq, timeout)
+            yield from batches(tags, scatter_gather)
+    except Exception as e:
+        relay.logger.error(f"Error in generate_flv: {e}")
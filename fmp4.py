@@ -0,0 +1,173 @@
+"""
+Minimal ISO BMFF (fragmented MP4) box parsing, just enough to split an
+ffmpeg fMP4 stream into its init segment and moof+mdat fragments and to
+read their duration and whether they start on a keyframe.
+"""
+
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+def read_box_header(data, offset, end):
+    """
+    Return (box type, payload start, box end) of the box at offset.
+    """
+    size = int.from_bytes(data[offset:offset + 4], 'big')
+    box_type = bytes(data[offset + 4:offset + 8])
+    header = 8
+    if size == 1:
+        size = int.from_bytes(data[offset + 8:offset + 16], 'big')
+        header = 16
+    elif size == 0:
+        size = end - offset
+    return box_type, offset + header, offset + size
+
+
+def iter_boxes(data, offset=0, end=None):
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        box_type, start, box_end = read_box_header(data, offset, end)
+        yield box_type, start, box_end
+        offset = box_end
+
+
+def find_box(data, box_type, offset=0, end=None):
+    for found_type, start, box_end in iter_boxes(data, offset, end):
+        if found_type == box_type:
+            return start, box_end
+    return None
+
+
+def read_stream_box(stream):
+    """
+    Read one whole top level box from a stream.
+    Return (box type, box bytes), or (None, b'') at the end of the stream.
+    """
+    header = stream.read(8)
+    if len(header) < 8:
+        return None, b''
+    size = int.from_bytes(header[:4], 'big')
+    if size == 1:
+        header += stream.read(8)
+        size = int.from_bytes(header[8:16], 'big')
+    body = stream.read(size - len(header))
+    if len(body) < size - len(header):
+        return None, b''
+    return header[4:8], header + body
+
+
+class TrackInfo(object):
+
+    def __init__(self, track_id):
+        self.track_id = track_id
+        self.timescale = 1000
+        self.handler = b''
+        self.default_duration = 0
+        self.default_flags = 0
+
+
+def parse_init(init):
+    """
+    Read the tracks of an init segment (ftyp + moov).
+    Return a dict of TrackInfo by track id.
+    """
+    tracks = {}
+    moov = find_box(init, b'moov')
+    if moov is None:
+        return tracks
+
+    for box_type, start, end in iter_boxes(init, *moov):
+        if box_type == b'trak':
+            tkhd = find_box(init, b'tkhd', start, end)
+            version = init[tkhd[0]]
+            id_offset = tkhd[0] + (20 if version == 1 else 12)
+            track = TrackInfo(int.from_bytes(init[id_offset:id_offset + 4], 'big'))
+
+            mdia = find_box(init, b'mdia', start, end)
+            mdhd = find_box(init, b'mdhd', *mdia)
+            version = init[mdhd[0]]
+            ts_offset = mdhd[0] + (20 if version == 1 else 12)
+            track.timescale = int.from_bytes(init[ts_offset:ts_offset + 4], 'big')
+            hdlr = find_box(init, b'hdlr', *mdia)
+            track.handler = bytes(init[hdlr[0] + 8:hdlr[0] + 12])
+            tracks[track.track_id] = track
+
+        elif box_type == b'mvex':
+            for trex_type, trex_start, _ in iter_boxes(init, start, end):
+                if trex_type == b'trex':
+                    track_id = int.from_bytes(init[trex_start + 4:trex_start + 8], 'big')
+                    track = tracks.setdefault(track_id, TrackInfo(track_id))
+                    track.default_duration = int.from_bytes(init[trex_start + 12:trex_start + 16], 'big')
+                    track.default_flags = int.from_bytes(init[trex_start + 20:trex_start + 24], 'big')
+    return tracks
+
+
+def parse_fragment(moof, tracks):
+    """
+    Return (duration in seconds, starts on keyframe) of a moof box.
+    The video track is used when there is one, the first track otherwise.
+    """
+    durations = {}
+    keyframes = {}
+    moof_payload = read_box_header(moof, 0, len(moof))
+
+    for box_type, start, end in iter_boxes(moof, moof_payload[1], moof_payload[2]):
+        if box_type != b'traf':
+            continue
+
+        tfhd = find_box(moof, b'tfhd', start, end)
+        tf_flags = int.from_bytes(moof[tfhd[0] + 1:tfhd[0] + 4], 'big')
+        track_id = int.from_bytes(moof[tfhd[0] + 4:tfhd[0] + 8], 'big')
+        track = tracks.get(track_id) or TrackInfo(track_id)
+        default_duration, default_flags = track.default_duration, track.default_flags
+
+        offset = tfhd[0] + 8
+        if tf_flags & 0x01:
+            offset += 8
+        if tf_flags & 0x02:
+            offset += 4
+        if tf_flags & 0x08:
+            default_duration = int.from_bytes(moof[offset:offset + 4], 'big')
+            offset += 4
+        if tf_flags & 0x10:
+            offset += 4
+        if tf_flags & 0x20:
+            default_flags = int.from_bytes(moof[offset:offset + 4], 'big')
+
+        duration = 0
+        first_flags = None
+        for run_type, run_start, _ in iter_boxes(moof, start, end):
+            if run_type != b'trun':
+                continue
+            tr_flags = int.from_bytes(moof[run_start + 1:run_start + 4], 'big')
+            sample_count = int.from_bytes(moof[run_start + 4:run_start + 8], 'big')
+            offset = run_start + 8
+            if tr_flags & 0x01:
+                offset += 4
+            if tr_flags & 0x04:
+                if first_flags is None:
+                    first_flags = int.from_bytes(moof[offset:offset + 4], 'big')
+                offset += 4
+
+            fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if tr_flags & bit]
+            for _ in range(sample_count):
+                sample_duration = default_duration
+                for bit in fields:
+                    value = int.from_bytes(moof[offset:offset + 4], 'big')
+                    if bit == 0x100:
+                        sample_duration = value
+                    elif bit == 0x400 and first_flags is None:
+                        first_flags = value
+                    offset += 4
+                duration += sample_duration
+
+        if first_flags is None:
+            first_flags = default_flags
+        durations[track_id] = duration / track.timescale
+        keyframes[track_id] = not first_flags & SAMPLE_IS_NON_SYNC if track.handler == b'vide' else True
+
+    if not durations:
+        return 0.0, True
+
+    video = [track_id for track_id in durations if tracks.get(track_id) and tracks[track_id].handler == b'vide']
+    track_id = video[0] if video else next(iter(durations))
+    return durations[track_id], keyframes[track_id]
@@ -0,0 +1,254 @@
+import struct
+import time
+import sys
+from multiprocessing import shared_memory
+from threading import Thread, Condition
+from viewers import ViewerRegistry
+
+MAGIC = b'FBUS'
+VERSION = 1
+
+# magic, version, slot count, slot size, latest sequence number
+HEADER = struct.Struct('<4sIIIQ')
+HEADER_SIZE = 64
+
+# sequence number, payload length, kind, width, height, channels
+SLOT_HEADER = struct.Struct('<QIIHHH')
+SLOT_HEADER_SIZE = 64
+
+KIND_JPEG = 1
+KIND_BGR = 2
+
+
+class FrameBus(object):
+    """
+    Ring of fixed-size frame slots in shared memory, written by one capture
+    process and read zero-copy by any number of HTTP worker processes.
+    Frames are never pickled or sent through a pipe: readers get a
+    memoryview of the slot.
+
+    Each slot is protected by a sequence lock: the writer clears the slot
+    sequence number while it copies a frame in, so a reader checks the
+    number again once it is done with the view (see is_current).
+    """
+
+    def __init__(self, name, slots=8, slot_size=8 * 1024 * 1024, create=False):
+        self.name = name
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_size))
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, slot_size, 0)
+        else:
+            if sys.version_info >= (3, 13):
+                # Only the creator owns the segment, a reader exiting must not unlink it
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+            magic, version, slots, slot_size, _ = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{name} is not a frame bus")
+        self.owner = create
+        self.slots = slots
+        self.slot_size = slot_size
+
+    def close(self):
+        """
+        Detach from the bus, the creator also destroys it.
+        Payload views returned by read must have been released first.
+        """
+        if self.owner:
+            # Readers still attached to the segment see it closed
+            self.shm.buf[0:4] = b'\0' * 4
+            self.shm.unlink()
+        self.shm.close()
+
+    @property
+    def closed(self):
+        return bytes(self.shm.buf[0:4]) != MAGIC
+
+    def slot_offset(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_size)
+
+    @property
+    def latest_seq(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[4]
+
+    def write(self, seq, data, kind=KIND_JPEG, width=0, height=0, channels=0):
+        """
+        Copy a frame into the slot of seq and make it the latest one.
+        seq must be strictly increasing.
+        """
+        length = len(data)
+        if length > self.slot_size:
+            raise ValueError(f"Frame of {length} bytes does not fit in a {self.slot_size} bytes slot")
+
+        offset = self.slot_offset(seq)
+        buf = self.shm.buf
+        # Mark the slot as being written, then copy the payload in
+        SLOT_HEADER.pack_into(buf, offset, 0, 0, 0, 0, 0, 0)
+        start = offset + SLOT_HEADER_SIZE
+        buf[start:start + length] = memoryview(data).cast('B')
+        SLOT_HEADER.pack_into(buf, offset, seq, length, kind, width, height, channels)
+        struct.pack_into('<Q', buf, HEADER.size - 8, seq)
+
+    def read(self, seq=None):
+        """
+        Return (seq, kind, width, height, channels, payload view) of the frame
+        seq, or of the latest frame when seq is None. Returns None when the
+        slot does not hold that frame anymore.
+        """
+        if seq is None:
+            seq = self.latest_seq
+            if not seq:
+                return None
+
+        offset = self.slot_offset(seq)
+        slot_seq, length, kind, width, height, channels = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + SLOT_HEADER_SIZE
+        return seq, kind, width, height, channels, self.shm.buf[start:start + length]
+
+    def is_current(self, seq):
+        """
+        Whether the slot still holds the frame seq, i.e. whether a view
+        obtained from read(seq) was not overwritten while it was used.
+        """
+        return SLOT_HEADER.unpack_from(self.shm.buf, self.slot_offset(seq))[0] == seq
+
+    def wait_for_frame(self, min_seq, timeout=None, poll_interval=0.002):
+        """
+        Block until a frame with a sequence number >= min_seq is written.
+        Return the latest sequence number, or None if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq
+            if seq >= min_seq:
+                return seq
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+
+class SharedCamera(object):
+    """
+    Reader side of a frame bus exposing the part of the ThreadedCamera
+    interface generate_frames and the snapshot route rely on, so an HTTP
+    worker process serves frames encoded by another process.
+
+    A single watcher thread polls the bus while viewers wait for a frame
+    and wakes them up, instead of every viewer polling the shared memory.
+    """
+
+    def __init__(self, bus, stall_timeout=5, poll_interval=0.002):
+        self.bus = bus
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.part_header = (0, b'')
+        # Sequence numbers start over with every bus
+        self.epoch = bus.name
+        self.condition = Condition()
+        self.waiting = 0
+        self.closed = False
+        Thread(target=self.watch, args=(), daemon=True).start()
+
+    def watch(self):
+        seq = self.bus.latest_seq
+        while not self.closed:
+            with self.condition:
+                # Idle while no viewer waits, the bus closing is still noticed
+                if not self.condition.wait_for(lambda: self.waiting, 1):
+                    self.closed = self.bus.closed
+                    continue
+            time.sleep(self.poll_interval)
+            closed = self.bus.closed
+            if self.bus.latest_seq != seq or closed:
+                seq = self.bus.latest_seq
+                with self.condition:
+                    self.closed = closed
+                    self.condition.notify_all()
+
+    @property
+    def running(self):
+        return not self.bus.closed
+
+    @property
+    def frame_seq(self):
+        return self.bus.latest_seq
+
+    @property
+    def grabbed(self):
+        # Frames are only written to the bus once decoded
+        return self.bus.latest_seq
+
+    def select_rendition(self, height):
+        # The capture process publishes a single rendition on the bus
+        return None
+
+    def subscribe(self, rendition=None, skip_frames=1):
+        pass
+
+    def unsubscribe(self, rendition=None, skip_frames=1):
+        pass
+
+    def wait_for_frame(self, min_seq, timeout=None):
+        with self.condition:
+            self.waiting += 1
+            # Wakes the watcher up
+            self.condition.notify_all()
+            try:
+                if self.condition.wait_for(lambda: self.bus.latest_seq >= min_seq or self.closed, timeout):
+                    seq = self.bus.latest_seq
+                    return seq if seq >= min_seq else None
+                return None
+            finally:
+                self.waiting -= 1
+
+    def is_current(self, seq):
+        # The payload views are only valid until the slot is written again
+        return self.bus.is_current(seq)
+
+    def get_encoded_part(self, rendition=None):
+        frame = self.bus.read()
+        if frame is None:
+            return 0, b'', b''
+        seq, _, _, _, _, payload = frame
+        if self.part_header[0] != seq:
+            self.part_header = (seq, b'--frame\r\n'
+                                     b'Content-Type: image/jpeg\r\n'
+                                     b'Content-Length: %d\r\n\r\n' % len(payload))
+        return seq, payload, self.part_header[1]
+
+    def get_ready_part(self, rendition=None):
+        # The bus always holds the last encoded frame
+        return self.get_encoded_part(rendition)
+
+    def get_encoded_frame(self, rendition=None):
+        while True:
+            seq, payload, _ = self.get_encoded_part(rendition)
+            frame = bytes(payload)
+            # A slot written again during the copy gives a torn jpeg, read the latest frame again
+            if not seq or self.bus.is_current(seq):
+                return seq, frame
+
+    def stats(self):
+        return {"state": "shared", "frame_seq": self.bus.latest_seq}
+
+
+class SharedChannel(object):
+    """
+    MJPEG side of a channel whose capture runs in another process, served
+    from its frame bus by the same routes as a local Channel.
+    """
+
+    def __init__(self, bus, logger, viewer_timeout=10, stall_timeout=5):
+        self.bus = bus
+        self.logger = logger
+        self.camera = SharedCamera(bus, stall_timeout)
+        self.viewers = ViewerRegistry(viewer_timeout)
+        self.relay = None
+        self.segmenter = None
+
+    def stats(self):
+        return {'bus': self.bus.name, 'camera': self.camera.stats(), 'viewers': self.viewers.stats()}
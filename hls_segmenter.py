@@ -0,0 +1,210 @@
+import logging
+import math
+import subprocess
+from collections import OrderedDict
+from threading import Thread, Condition
+
+import fmp4
+from flv_relay import generate_flv
+
+
+class Segment(object):
+    """
+    fMP4 media segment: one or more moof+mdat fragments, starting on a keyframe.
+    """
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.chunks = []
+        self.durations = []
+        self.duration = 0.0
+        self.complete = False
+        self.data = b''
+
+    def append(self, chunk, duration):
+        self.chunks.append(chunk)
+        self.durations.append(duration)
+        self.duration += duration
+
+    def finish(self):
+        self.complete = True
+        self.data = b''.join(self.chunks)
+
+
+class HlsSegmenter(object):
+    """
+    Remuxes the relayed FLV into fMP4 segments with ffmpeg (no transcoding)
+    and keeps the latest ones in a bounded in-memory ring, along with a
+    rolling playlist rebuilt once per segment.
+    In low latency mode ffmpeg cuts part_duration long CMAF chunks, the
+    segment being written is announced in the playlist and its chunks are
+    published as soon as they are produced.
+    """
+
+    def __init__(self, relay, ffmpeg='ffmpeg', segment_duration=2, ring_size=6,
+                 low_latency=False, part_duration=0.2, logger=None):
+        self.relay = relay
+        self.logger = logger or logging.getLogger('logger')
+        self.ffmpeg = ffmpeg
+        self.segment_duration = segment_duration
+        self.ring_size = ring_size
+        self.low_latency = low_latency
+        self.part_duration = part_duration
+        self.process = None
+
+        self.init_segment = b''
+        self.tracks = {}
+        self.segments = OrderedDict()
+        self.current = None
+        self.next_seq = 0
+        self.playlist = ''
+        self.condition = Condition()
+
+    def start(self):
+        args = [self.ffmpeg, '-loglevel', 'error', '-i', 'pipe:0', '-c', 'copy',
+                '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+        if self.low_latency:
+            args += ['-frag_duration', str(int(self.part_duration * 1000000))]
+        self.process = subprocess.Popen(args + ['pipe:1'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        Thread(target=self.feed, args=(), daemon=True).start()
+        Thread(target=self.update, args=(), daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+        self.end()
+
+    def end(self):
+        """
+        Complete the segment being written, so no client streaming it waits
+        for chunks that will never come.
+        """
+        with self.condition:
+            if self.current is not None and not self.current.complete:
+                self.finish_segment()
+            self.condition.notify_all()
+
+    def feed(self):
+        """
+        Pipe the relayed FLV tags to ffmpeg.
+        """
+        try:
+            for buffers in generate_flv(self.relay):
+                self.process.stdin.writelines(buffers)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            self.process.stdin.close()
+
+    def update(self):
+        """
+        Split the ffmpeg output into the init segment and fragments.
+        """
+        init = []
+        while True:
+            box_type, box = fmp4.read_stream_box(self.process.stdout)
+            if box_type is None:
+                break
+
+            if box_type in (b'ftyp', b'moov'):
+                init.append(box)
+                if box_type == b'moov':
+                    self.init_segment = b''.join(init)
+                    self.tracks = fmp4.parse_init(self.init_segment)
+            elif box_type == b'moof':
+                moof = box
+            elif box_type == b'mdat':
+                self.add_fragment(moof + box, *fmp4.parse_fragment(moof, self.tracks))
+
+        self.logger.info("HLS segmenter: ffmpeg output ended")
+        self.end()
+
+    def add_fragment(self, fragment, duration, keyframe):
+        with self.condition:
+            if self.current is None or self.current.complete:
+                if not keyframe:
+                    return
+                self.current = Segment(self.next_seq)
+            elif keyframe and round(self.current.duration, 3) >= self.segment_duration:
+                self.finish_segment()
+                self.current = Segment(self.next_seq)
+
+            self.current.append(fragment, duration)
+            if self.low_latency and self.segments:
+                self.playlist = self.build_playlist()
+            self.condition.notify_all()
+
+    def finish_segment(self):
+        segment = self.current
+        segment.finish()
+        self.segments[segment.seq] = segment
+        while len(self.segments) > self.ring_size:
+            self.segments.popitem(last=False)
+        self.next_seq = segment.seq + 1
+        self.playlist = self.build_playlist()
+
+    def build_playlist(self):
+        segments = list(self.segments.values())
+        target = max(math.ceil(segment.duration) for segment in segments)
+        lines = ['#EXTM3U',
+                 '#EXT-X-VERSION:7',
+                 f'#EXT-X-TARGETDURATION:{target}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{segments[0].seq}',
+                 '#EXT-X-MAP:URI="init.mp4"']
+        if self.low_latency:
+            # PART-HOLD-BACK is mandatory with PART-INF, at least twice the part target
+            lines.insert(3, f'#EXT-X-PART-INF:PART-TARGET={self.part_duration:.3f}')
+            lines.insert(3, f'#EXT-X-SERVER-CONTROL:PART-HOLD-BACK={3 * self.part_duration:.3f}')
+        for segment in segments:
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(f'{segment.seq}.m4s')
+
+        current = self.current
+        if self.low_latency and current is not None and not current.complete:
+            # Parts of the segment being written, and the segment itself
+            # streamed with chunked transfer encoding as it grows
+            for part, duration in enumerate(current.durations):
+                lines.append(f'#EXT-X-PART:DURATION={duration:.3f},URI="{current.seq}.m4s?part={part}"')
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{current.seq}.m4s?part={len(current.durations)}"')
+            lines.append(f'#EXT-X-PREFETCH:{current.seq}.m4s')
+        return '\n'.join(lines) + '\n'
+
+    def get_segment(self, seq):
+        """
+        Return a published segment, or in low latency mode the one being written.
+        """
+        with self.condition:
+            if self.low_latency and self.current is not None and self.current.seq == seq:
+                return self.current
+            return self.segments.get(seq)
+
+    def get_part(self, segment, part, timeout=None):
+        """
+        Return a chunk of a segment, waiting for it while the segment is written.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(segment.chunks) > part or segment.complete, timeout)
+            if part < len(segment.chunks):
+                return segment.chunks[part]
+            return None
+
+
+def generate_segment(segmenter, segment, timeout=5, scatter_gather=True):
+    """
+    Stream a segment chunk by chunk while it is being written.
+    """
+    sent = 0
+    while True:
+        with segmenter.condition:
+            segmenter.condition.wait_for(lambda: len(segment.chunks) > sent or segment.complete, timeout)
+            chunks = segment.chunks[sent:]
+            complete = segment.complete
+
+        if chunks:
+            sent += len(chunks)
+            # Written by the server as one scatter-gather write
+            yield chunks if scatter_gather else b''.join(chunks)
+        elif complete:
+            break
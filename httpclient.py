@@ -1,24 +1,87 @@
+import random
 import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from logger_manager import LoggerManager
 
+# Statuses retried with backoff: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """
+    Exponential backoff with jitter, so the pollers of many channels hitting
+    the same rate limit do not all retry at the same instant.
+    A Retry-After header sent with a 429 or a 503 is honoured as is.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(backoff / 2, backoff)
+
+
+class TimeoutSession(req.Session):
+    """
+    Session applying a default timeout to every call, a call may still pass its own.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
 
 class HttpClient:
+    """
+    Single pooled HTTP client of the process, shared by every channel.
+    Connections are kept alive and pooled per host, idempotent requests are
+    retried with backoff on connection errors, 429 and 5xx responses.
+    """
 
-    def __init__(self, logger: LoggerManager):
+    def __init__(self, logger: LoggerManager, proxy=None, pool_connections=10, pool_maxsize=20,
+                 retries=3, backoff_factor=0.5, connect_timeout=5, read_timeout=15):
         self.req = None
         self.logger = logger
+        self.proxy = proxy
+        # Number of hosts with a pool of connections, and connections kept per host
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = (connect_timeout, read_timeout)
         self.configure_session()
 
+    @classmethod
+    def from_settings(cls, logger, settings):
+        """
+        Build the client from the proxy and http sections of config.yaml.
+        """
+        return cls(logger, proxy=settings.get('proxy'), **(settings.get('http') or {}))
+
     def configure_session(self) -> None:
-        self.req = req.Session()
+        self.req = TimeoutSession(self.timeout)
         self.req.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
             "Referer": "https://www.tiktok.com/"
         })
 
+        retry = JitteredRetry(total=self.retries, backoff_factor=self.backoff_factor,
+                              status_forcelist=RETRY_STATUSES, allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                              raise_on_status=False)
+        # pool_block=False: a burst beyond pool_maxsize opens extra connections
+        # instead of waiting, they are just not kept afterwards
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                              max_retries=retry)
+        self.req.mount('https://', adapter)
+        self.req.mount('http://', adapter)
+
+        if self.proxy:
+            self.req.proxies.update({'http': self.proxy, 'https': self.proxy})
+
     def close_session(self):
         if self.req:
             self.req.close()
             self.logger.info("HTTP session closed")
-
-
@@ -203,7 +203,7 @@ class ProxyMiddleware:
             def read() -> t.Iterator[bytes]:
                 while True:
                     try:
-                        data = resp.read(self.chunk_size)
+                        data = resp.read1(self.chunk_size)
                     except OSError:
                         break
 
@@ -14,9 +14,13 @@ It provides features like interactive debugging and code reloading. Use
 import errno
 import io
 import os
+import queue
+import signal
 import socket
 import socketserver
 import sys
+import threading
+import time
 import typing as t
 from datetime import datetime as dt
 from datetime import timedelta
@@ -69,6 +73,15 @@ except AttributeError:
 
 LISTEN_QUEUE = 128
 
+try:
+    # Most buffers a single sendmsg call accepts, more fail with EMSGSIZE.
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
 _TSSLContextArg = t.Optional[
     t.Union["ssl.SSLContext", t.Tuple[str, t.Optional[str]], "te.Literal['adhoc']"]
 ]
@@ -184,6 +197,9 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
             "wsgi.multiprocess": self.server.multiprocess,
             "wsgi.run_once": False,
             "werkzeug.socket": self.connection,
+            # Non-standard, the application may yield sequences of
+            # buffers, see run_wsgi
+            "werkzeug.scatter_gather": True,
             "SERVER_SOFTWARE": self.server_version,
             "REQUEST_METHOD": self.command,
             "SCRIPT_NAME": "",
@@ -212,6 +228,19 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
         if environ.get("HTTP_TRANSFER_ENCODING", "").strip().lower() == "chunked":
             environ["wsgi.input_terminated"] = True
             environ["wsgi.input"] = DechunkedInput(environ["wsgi.input"])
+        elif self.server.keep_alive and environ.get("CONTENT_LENGTH"):
+            from .wsgi import LimitedStream
+
+            # Track how much of the body the application reads, so the
+            # rest can be drained before the next request on the
+            # connection.
+            try:
+                content_length = max(0, int(environ["CONTENT_LENGTH"]))
+            except ValueError:
+                content_length = 0
+                self.close_connection = True
+
+            environ["wsgi.input"] = LimitedStream(self.rfile, content_length)
 
         # Per RFC 2616, if the URL is absolute, use that as the host.
         # We're using "has a scheme" to indicate an absolute URL.
@@ -281,13 +310,52 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
                     chunk_response = True
                     self.send_header("Transfer-Encoding", "chunked")
 
-                # Always close the connection. This disables HTTP/1.1
-                # keep-alive connections. They aren't handled well by
-                # Python's http.server because it doesn't know how to
-                # drain the stream before the next request line.
-                self.send_header("Connection", "close")
+                # Close the connection unless keep-alive is enabled on the
+                # server, the client did not ask to close it and the end
+                # of the response is known without closing it. The request
+                # body is drained after the response before reading the
+                # next request line.
+                if (
+                    self.server.keep_alive
+                    and not self.close_connection
+                    and not chunk_response
+                    and "connection" not in header_keys
+                    and (
+                        "content-length" in header_keys
+                        or environ["REQUEST_METHOD"] == "HEAD"
+                        or code in {204, 304}
+                    )
+                    and self.protocol_version >= "HTTP/1.1"
+                ):
+                    self.send_header("Connection", "keep-alive")
+                    self.send_header(
+                        "Keep-Alive", f"timeout={self.server.keep_alive_timeout}"
+                    )
+                else:
+                    self.close_connection = True
+
+                    if "connection" not in header_keys:
+                        self.send_header("Connection", "close")
+
                 self.end_headers()
 
+            if isinstance(data, (tuple, list)):
+                # Non-standard extension: a sequence of bytes-like buffers
+                # is written as one chunk with a single scatter-gather
+                # write, without concatenating the buffers first.
+                buffers = [memoryview(buf).cast("B") for buf in data]
+                length = sum(len(buf) for buf in buffers)
+
+                if length:
+                    if chunk_response:
+                        buffers.insert(0, memoryview(f"{length:x}\r\n".encode()))
+                        buffers.append(memoryview(b"\r\n"))
+
+                    self.send_buffers(buffers)
+
+                self.wfile.flush()
+                return
+
             assert isinstance(data, bytes), "applications must write bytes"
 
             if data:
@@ -331,14 +399,22 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
 
         try:
             execute(self.server.app)
+
+            if not self.close_connection:
+                self.drain_input(environ)
+
+            if not self.close_connection:
+                self.wait_for_request()
         except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
             self.connection_dropped(e, environ)
         except Exception as e:
             if self.server.passthrough_errors:
                 raise
 
-            if status_sent is not None and chunk_response:
-                self.close_connection = True
+            # The request body may be left unread, the next request of a
+            # kept-alive connection would start inside it.
+            self.close_connection = True
 
             try:
                 # if we haven't yet sent the headers but they are set
@@ -355,6 +431,73 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
             msg = DebugTraceback(e).render_traceback_text()
             self.server.log("error", f"Error on request:\n{msg}")
 
+    def drain_input(self, environ: "WSGIEnvironment", limit: int = 1 << 20) -> None:
+        """Discard the part of the request body the application did not
+        read, so the next request on a keep-alive connection starts at
+        its request line. Closes the connection instead when more than
+        ``limit`` bytes are left, or when the length is unknown.
+        """
+        stream = environ["wsgi.input"]
+
+        if isinstance(stream, DechunkedInput):
+            while limit > 0:
+                chunk = stream.read(min(limit, 64 * 1024))
+
+                if not chunk:
+                    break
+
+                limit -= len(chunk)
+            else:
+                self.close_connection = True
+        elif hasattr(stream, "limit"):
+            if stream.limit - stream.tell() > limit:
+                self.close_connection = True
+            else:
+                stream.exhaust()
+
+    def wait_for_request(self) -> None:
+        """Wait at most ``keep_alive_timeout`` seconds for the next request
+        on a keep-alive connection, and close it quietly otherwise.
+        """
+        self.connection.settimeout(self.server.keep_alive_timeout)
+
+        try:
+            if not self.rfile.peek(1):
+                self.close_connection = True
+        except (ConnectionError, socket.timeout):
+            self.close_connection = True
+        finally:
+            if not self.close_connection:
+                self.connection.settimeout(self.timeout)
+
+    def send_buffers(self, buffers: t.List[memoryview]) -> None:
+        """Write several buffers to the client with as few system calls as
+        possible. Uses scatter-gather ``sendmsg`` calls of at most
+        ``IOV_MAX`` buffers where the socket supports it, and falls back
+        to one write per buffer otherwise (TLS sockets, Windows).
+        """
+        sendmsg = getattr(self.connection, "sendmsg", None)
+
+        if sendmsg is None or self.server.ssl_context is not None:
+            for buf in buffers:
+                self.wfile.write(buf)
+            return
+
+        buffers = [buf for buf in buffers if len(buf)]
+        start = 0
+
+        while start < len(buffers):
+            sent = sendmsg(buffers[start : start + IOV_MAX])
+
+            # Skip the fully sent buffers and slice the partially sent one.
+            while sent:
+                if sent >= len(buffers[start]):
+                    sent -= len(buffers[start])
+                    start += 1
+                else:
+                    buffers[start] = buffers[start][sent:]
+                    sent = 0
+
     def handle(self) -> None:
         """Handles a request ignoring dropped connections."""
         try:
@@ -658,6 +801,10 @@ class BaseWSGIServer(HTTPServer):
     multiprocess = False
     request_queue_size = LISTEN_QUEUE
     allow_reuse_address = True
+    #: Keep HTTP/1.1 connections open between responses with a known
+    #: length, see :func:`make_server`.
+    keep_alive = False
+    keep_alive_timeout = 5
 
     def __init__(
         self,
@@ -668,6 +815,7 @@ class BaseWSGIServer(HTTPServer):
         passthrough_errors: bool = False,
         ssl_context: t.Optional[_TSSLContextArg] = None,
         fd: t.Optional[int] = None,
+        reuse_port: bool = False,
     ) -> None:
         if handler is None:
             handler = WSGIRequestHandler
@@ -684,6 +832,7 @@ class BaseWSGIServer(HTTPServer):
         self.port = port
         self.app = app
         self.passthrough_errors = passthrough_errors
+        self.reuse_port = reuse_port
 
         self.address_family = address_family = select_address_family(host, port)
         server_address = get_sockaddr(host, int(port), address_family)
@@ -758,6 +907,14 @@ class BaseWSGIServer(HTTPServer):
         else:
             self.ssl_context = None
 
+    def server_bind(self) -> None:
+        if self.reuse_port:
+            # Several processes listen on the same port, the kernel
+            # balances the accepted connections between them.
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        super().server_bind()
+
     def log(self, type: str, message: str, *args: t.Any) -> None:
         _log(type, message, *args)
 
@@ -823,6 +980,100 @@ class ThreadedWSGIServer(socketserver.ThreadingMixIn, BaseWSGIServer):
     daemon_threads = True
 
 
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    """A WSGI server that handles concurrent requests in a fixed pool of
+    worker threads.
+
+    Accepted connections wait in a queue of at most ``queue_size``
+    entries until a worker is free. When the queue is full, the
+    connection is answered right away with a ``503 Service
+    Unavailable`` and a ``Retry-After`` header instead of creating
+    another thread, so a connection storm cannot exhaust memory.
+
+    Use :func:`make_server` to create a server instance.
+    """
+
+    multithread = True
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        app: "WSGIApplication",
+        pool_size: int = 16,
+        queue_size: int = 64,
+        retry_after: int = 1,
+        handler: t.Optional[t.Type[WSGIRequestHandler]] = None,
+        passthrough_errors: bool = False,
+        ssl_context: t.Optional[_TSSLContextArg] = None,
+        fd: t.Optional[int] = None,
+        reuse_port: bool = False,
+    ) -> None:
+        super().__init__(
+            host, port, app, handler, passthrough_errors, ssl_context, fd, reuse_port
+        )
+        self.pool_size = pool_size
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._requests: "queue.Queue[t.Any]" = queue.Queue(queue_size)
+        self._workers = []
+
+        for _ in range(pool_size):
+            worker = threading.Thread(target=self._process_requests, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _process_requests(self) -> None:
+        while True:
+            item = self._requests.get()
+
+            if item is None:
+                return
+
+            request, client_address = item
+
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(
+        self, request: t.Any, client_address: t.Union[t.Tuple[str, int], str]
+    ) -> None:
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected += 1
+            self.reject_request(request)
+            self.shutdown_request(request)
+
+    def reject_request(self, request: t.Any) -> None:
+        """Answer a connection the pool has no room for with a 503,
+        without reading the request.
+        """
+        try:
+            request.settimeout(1)
+            request.sendall(
+                b"HTTP/1.1 503 Service Unavailable\r\n"
+                b"Retry-After: %d\r\n"
+                b"Content-Length: 0\r\n"
+                b"Connection: close\r\n\r\n" % self.retry_after
+            )
+        except OSError:
+            pass
+
+    def server_close(self) -> None:
+        super().server_close()
+
+        for _ in getattr(self, "_workers", ()):
+            try:
+                self._requests.put_nowait(None)
+            except queue.Full:
+                break
+
+
 class ForkingWSGIServer(ForkingMixIn, BaseWSGIServer):
     """A WSGI server that handles concurrent requests in separate forked
     processes.
@@ -860,9 +1111,14 @@ def make_server(
     passthrough_errors: bool = False,
     ssl_context: t.Optional[_TSSLContextArg] = None,
     fd: t.Optional[int] = None,
+    pool_size: int = 0,
+    pool_queue_size: int = 64,
+    keep_alive: bool = False,
+    keep_alive_timeout: int = 5,
+    reuse_port: bool = False,
 ) -> BaseWSGIServer:
     """Create an appropriate WSGI server instance based on the value of
-    ``threaded`` and ``processes``.
+    ``pool_size``, ``threaded`` and ``processes``.
 
     This is called from :func:`run_simple`, but can be used separately
     to have access to the server object, such as to run it in a separate
@@ -870,16 +1126,40 @@ def make_server(
 
     See :func:`run_simple` for parameter docs.
     """
-    if threaded and processes > 1:
+    if (threaded or pool_size) and processes > 1:
         raise ValueError("Cannot have a multi-thread and multi-process server.")
 
-    if threaded:
-        return ThreadedWSGIServer(
-            host, port, app, request_handler, passthrough_errors, ssl_context, fd=fd
-        )
+    if reuse_port and processes > 1:
+        raise ValueError("Cannot have a forking server listening with SO_REUSEPORT.")
 
-    if processes > 1:
-        return ForkingWSGIServer(
+    srv: BaseWSGIServer
+
+    if pool_size:
+        srv = ThreadPoolWSGIServer(
+            host,
+            port,
+            app,
+            pool_size,
+            pool_queue_size,
+            handler=request_handler,
+            passthrough_errors=passthrough_errors,
+            ssl_context=ssl_context,
+            fd=fd,
+            reuse_port=reuse_port,
+        )
+    elif threaded:
+        srv = ThreadedWSGIServer(
+            host,
+            port,
+            app,
+            request_handler,
+            passthrough_errors,
+            ssl_context,
+            fd=fd,
+            reuse_port=reuse_port,
+        )
+    elif processes > 1:
+        srv = ForkingWSGIServer(
             host,
             port,
             app,
@@ -889,10 +1169,84 @@ def make_server(
             ssl_context,
             fd=fd,
         )
+    else:
+        srv = BaseWSGIServer(
+            host,
+            port,
+            app,
+            request_handler,
+            passthrough_errors,
+            ssl_context,
+            fd=fd,
+            reuse_port=reuse_port,
+        )
 
-    return BaseWSGIServer(
-        host, port, app, request_handler, passthrough_errors, ssl_context, fd=fd
-    )
+    srv.keep_alive = keep_alive
+    srv.keep_alive_timeout = keep_alive_timeout
+    return srv
+
+
+def _run_reuse_port_processes(
+    processes: int, port: int, make: t.Callable[[int], BaseWSGIServer]
+) -> None:
+    """Fork ``processes`` servers listening on the same port with
+    ``SO_REUSEPORT`` and wait for them, starting a crashed one again.
+    The parent process only supervises, it does not accept connections.
+    """
+    # Bind once in the parent to report errors such as an address
+    # already in use, and to pick the port every process binds when
+    # port 0 was requested. The socket is closed before forking so the
+    # kernel never hands connections to a socket nobody accepts on.
+    srv = make(port)
+    port = srv.port
+    srv.log_startup()
+    srv.server_close()
+    _log("info", f" * Listening with {processes} SO_REUSEPORT processes")
+    _log("info", _ansi_style("Press CTRL+C to quit", "yellow"))
+
+    children = set()
+
+    def spawn() -> None:
+        pid = os.fork()
+
+        if pid == 0:
+            code = 1
+
+            try:
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+                make(port).serve_forever()
+                code = 0
+            except Exception as e:
+                _log("error", f" * Listener process failed: {e}")
+            finally:
+                os._exit(code)
+
+        children.add(pid)
+
+    for _ in range(processes):
+        spawn()
+
+    # Stop the listeners on SIGTERM as well as on CTRL+C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        while children:
+            pid, status = os.wait()
+            children.discard(pid)
+
+            if os.waitstatus_to_exitcode(status) != 0:
+                _log("error", f" * Listener process {pid} died, starting another one")
+                time.sleep(1)
+                spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
 
 
 def is_running_from_reloader() -> bool:
@@ -921,6 +1275,11 @@ def run_simple(
     static_files: t.Optional[t.Dict[str, t.Union[str, t.Tuple[str, str]]]] = None,
     passthrough_errors: bool = False,
     ssl_context: t.Optional[_TSSLContextArg] = None,
+    pool_size: int = 0,
+    pool_queue_size: int = 64,
+    keep_alive: bool = False,
+    keep_alive_timeout: int = 5,
+    reuse_port_processes: int = 0,
 ) -> None:
     """Start a development server for a WSGI application. Various
     optional features can be enabled.
@@ -961,6 +1320,23 @@ def run_simple(
         used with ``processes``.
     :param processes: Handle concurrent requests using up to this number
         of processes. Cannot be used with ``threaded``.
+    :param pool_size: Handle concurrent requests using a fixed pool of
+        this many threads instead of a thread per connection. Takes
+        precedence over ``threaded``, cannot be used with ``processes``.
+    :param pool_queue_size: Number of accepted connections waiting for
+        a free pool thread. Connections beyond it are answered with a
+        ``503`` and a ``Retry-After`` header.
+    :param keep_alive: Keep HTTP/1.1 connections open after responses
+        with a known length, instead of closing them after every
+        response. Requires ``threaded`` or ``pool_size``.
+    :param keep_alive_timeout: Seconds an idle keep-alive connection
+        waits for its next request before it is closed.
+    :param reuse_port_processes: Pre-fork this many processes that each
+        bind the port with ``SO_REUSEPORT``, the kernel balances the
+        accepted connections between them. Every process serves its own
+        copy of the application, state created before the fork is not
+        shared. A process that crashes is started again. Cannot be used
+        with ``processes`` or the reloader.
     :param request_handler: Use a different
         :class:`~BaseHTTPServer.BaseHTTPRequestHandler` subclass to
         handle requests.
@@ -1029,6 +1405,33 @@ def run_simple(
 
         application = DebuggedApplication(application, evalex=use_evalex)
 
+    if reuse_port_processes > 1:
+        if use_reloader:
+            raise ValueError("Cannot use the reloader with SO_REUSEPORT processes.")
+
+        if not can_fork or not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("Your platform does not support SO_REUSEPORT processes.")
+
+        def make_reuse_port_server(port: int) -> BaseWSGIServer:
+            return make_server(
+                hostname,
+                port,
+                application,
+                threaded,
+                processes,
+                request_handler,
+                passthrough_errors,
+                ssl_context,
+                pool_size=pool_size,
+                pool_queue_size=pool_queue_size,
+                keep_alive=keep_alive,
+                keep_alive_timeout=keep_alive_timeout,
+                reuse_port=True,
+            )
+
+        _run_reuse_port_processes(reuse_port_processes, port, make_reuse_port_server)
+        return
+
     if not is_running_from_reloader():
         fd = None
     else:
@@ -1044,6 +1447,10 @@ def run_simple(
         passthrough_errors,
         ssl_context,
         fd=fd,
+        pool_size=pool_size,
+        pool_queue_size=pool_queue_size,
+        keep_alive=keep_alive,
+        keep_alive_timeout=keep_alive_timeout,
     )
     srv.socket.set_inheritable(True)
     os.environ["WERKZEUG_SERVER_FD"] = str(srv.fileno())
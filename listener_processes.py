@@ -0,0 +1,108 @@
+import json
+import os
+from threading import Thread, Lock
+
+
+class ListenerProcesses:
+    """
+    Runs the scheduler once, in the parent of the SO_REUSEPORT listener
+    processes, and replays the pipeline starts and stops it decides in every
+    listener: each one serves its own copy of the live pipelines, while the
+    live checks and the live history stay those of a single scheduler.
+
+    start and stop are the start_pipeline and stop_pipeline of the scheduler.
+    Every listener forked afterwards gets a pipe from the parent, the channels
+    already live are replayed first. on_fork(), then start_pipeline(channel,
+    room_id) and stop_pipeline(channel) run in the listener.
+    """
+
+    def __init__(self, logger, start_pipeline, stop_pipeline, on_fork):
+        self.logger = logger
+        self.start_pipeline = start_pipeline
+        self.stop_pipeline = stop_pipeline
+        self.on_fork = on_fork
+        self.parent = os.getpid()
+        self.lock = Lock()
+        # Channel name -> start message of the channels live now
+        self.live = {}
+        # Write ends of the pipes to the listeners
+        self.pipes = []
+        self.forking = None
+
+    def install(self):
+        os.register_at_fork(before=self.before_fork, after_in_parent=self.after_fork_in_parent,
+                            after_in_child=self.after_fork_in_child)
+        return self
+
+    def start(self, channel, room_id):
+        message = {'command': 'start', 'channel': channel, 'room_id': room_id}
+        with self.lock:
+            self.live[channel['name']] = message
+            self.send(message)
+
+    def stop(self, channel):
+        message = {'command': 'stop', 'channel': channel}
+        with self.lock:
+            self.live.pop(channel['name'], None)
+            self.send(message)
+
+    def send(self, message, pipes=None):
+        line = (json.dumps(message) + '\n').encode()
+        for fd in list(pipes or self.pipes):
+            try:
+                os.write(fd, line)
+            except OSError:
+                # The listener died, its replacement gets a new pipe
+                self.pipes.remove(fd)
+                os.close(fd)
+
+    def before_fork(self):
+        if os.getpid() != self.parent:
+            return
+        # Held across the fork, no message is sent while the live channels are replayed
+        self.lock.acquire()
+        self.forking = os.pipe()
+
+    def after_fork_in_parent(self):
+        if os.getpid() != self.parent or self.forking is None:
+            return
+        read, write = self.forking
+        self.forking = None
+        os.close(read)
+        self.pipes.append(write)
+        try:
+            for message in self.live.values():
+                self.send(message, [write])
+        finally:
+            self.lock.release()
+
+    def after_fork_in_child(self):
+        if self.forking is None:
+            return
+        read, write = self.forking
+        self.forking = None
+        os.close(write)
+        for fd in self.pipes:
+            os.close(fd)
+        self.pipes = []
+        self.live = {}
+        self.lock = Lock()
+
+        self.on_fork()
+        Thread(target=self.follow, args=(read,), daemon=True).start()
+
+    def follow(self, fd):
+        """
+        Start and stop the pipelines of this listener as the scheduler of the parent says.
+        """
+        with os.fdopen(fd) as pipe:
+            for line in pipe:
+                message = json.loads(line)
+                try:
+                    if message['command'] == 'start':
+                        self.start_pipeline(message['channel'], message['room_id'])
+                    else:
+                        self.stop_pipeline(message['channel'])
+                except Exception as ex:
+                    self.logger.error(f"Listener {os.getpid()}: unable to {message['command']} "
+                                      f"{message['channel']['name']}: {ex}")
@@ -0,0 +1,216 @@
+import math
+import sqlite3
+import time
+from threading import Lock
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Requests of one check of an offline creator: room detail, then the live page
+OFFLINE_CHECK_REQUESTS = 2
+
+
+class LiveHistory:
+    """
+    On-disk record of the live sessions of every polled username, the start
+    times of the last days days are kept in memory to estimate when a
+    creator is likely to go live.
+    """
+
+    def __init__(self, path='history.sqlite3', days=28):
+        self.path = path
+        self.days = days
+        self.lock = Lock()
+        self.db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sessions (user TEXT, started REAL, ended REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user, started)')
+        # First time a user was polled, the history says nothing about the time before
+        self.db.execute('CREATE TABLE IF NOT EXISTS observed (user TEXT PRIMARY KEY, since REAL)')
+        self.starts = {}
+        self.since = {}
+        self.load()
+
+    def load(self):
+        horizon = time.time() - self.days * DAY
+        with self.lock:
+            for user, since in self.db.execute('SELECT user, since FROM observed'):
+                self.since[user] = since
+            for user, started in self.db.execute('SELECT user, started FROM sessions WHERE started > ? '
+                                                 'ORDER BY started', (horizon,)):
+                self.starts.setdefault(user, []).append(started)
+
+    def observe(self, user, now=None):
+        if user not in self.since:
+            self.since[user] = now or time.time()
+            with self.lock:
+                self.db.execute('INSERT OR IGNORE INTO observed VALUES (?, ?)', (user, self.since[user]))
+
+    def session_started(self, user, now=None):
+        now = now or time.time()
+        starts = self.starts.setdefault(user, [])
+        starts.append(now)
+        while starts[0] < now - self.days * DAY:
+            starts.pop(0)
+        with self.lock:
+            self.db.execute('INSERT INTO sessions VALUES (?, ?, NULL)', (user, now))
+
+    def session_ended(self, user, now=None):
+        with self.lock:
+            self.db.execute('UPDATE sessions SET ended = ? WHERE user = ? AND ended IS NULL',
+                            (now or time.time(), user))
+
+    def start_rate(self, user, now, window):
+        """
+        Expected live starts of user per hour around now: the higher of the
+        rates of starts within window seconds of the same time of day and of
+        the same time of the week. Both are smoothed towards the average rate
+        with one more day (week) at that rate, so a short history counts less.
+        """
+        starts = self.starts.get(user, ())
+        if not starts:
+            return 0.0
+        observed = max(now - self.since.get(user, now), DAY)
+        span = 2 * window / HOUR
+        daily = weekly = 0
+        for started in starts:
+            offset = (started - now) % DAY
+            if min(offset, DAY - offset) <= window:
+                daily += 1
+                offset = (started - now) % WEEK
+                if min(offset, WEEK - offset) <= window:
+                    weekly += 1
+        days = min(observed, self.days * DAY) / DAY
+        average = len(starts) / (days * 24) * span
+        return max((daily + average) / (days + 1), (weekly + average) / (days / 7 + 1)) / span
+
+    def stats(self, user):
+        return {"starts": len(self.starts.get(user, ())), "observed_since": self.since.get(user)}
+
+
+class AdaptiveSchedule:
+    """
+    Polling intervals learned from the live history of every creator, planned
+    so the checks of all of them stay within budget requests per second.
+
+    Offline creators are polled in proportion to the square root of their
+    expected start rate, which minimises the total delay before a new live
+    is noticed for a given number of requests: densely around the times
+    they usually go live, sparsely otherwise. A creator expected to start
+    dense_rate times per hour is polled every min_interval seconds, one
+    without history counts as starting prior times per hour. The budget is
+    a ceiling: the frequencies are scaled down together only when their
+    total would exceed it. Live creators are polled every live_interval
+    seconds to notice the end of their live, out of the budget first, and
+    offline ones at least every max_interval seconds. When these alone
+    exceed the budget, both intervals are stretched to fit it.
+    """
+
+    def __init__(self, logger, history='history.sqlite3', history_days=28, budget=0.5, window=2700, prior=1 / 168,
+                 dense_rate=0.5, min_interval=30, max_interval=1200, live_interval=60, replan_interval=300):
+        self.logger = logger
+        self.history = LiveHistory(history, history_days)
+        self.budget = budget
+        self.window = window
+        self.prior = prior
+        self.dense_rate = dense_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.live_interval = live_interval
+        self.replan_interval = replan_interval
+        self.intervals = {}
+        self.planned_at = None
+        self.planned_rate = 0.0
+        # Factor live_interval and max_interval are stretched by to fit the budget
+        self.stretch = 1.0
+        self.live = {}
+
+    def on_status(self, creator, live):
+        """
+        LivePoller listener recording the sessions, only a start seen by a
+        check is a start: a creator already live at the first check is not.
+        """
+        if live and self.live.get(creator.user) is False:
+            self.history.session_started(creator.user)
+        elif not live and self.live.get(creator.user):
+            self.history.session_ended(creator.user)
+        if live:
+            self.intervals[creator.user] = self.live_interval * self.stretch
+        elif self.live.get(creator.user):
+            # Back in the offline budget from the next plan on
+            self.intervals.pop(creator.user, None)
+        self.live[creator.user] = live
+
+    def interval(self, creator, creators):
+        """
+        Seconds until the next check of creator, before jitter and backoff.
+        """
+        now = time.time()
+        if self.planned_at is None or now - self.planned_at >= self.replan_interval or creator.user not in self.intervals:
+            self.plan(creators, now)
+        return self.intervals[creator.user]
+
+    def plan(self, creators, now):
+        offline = {}
+        live = []
+        for user, creator in creators.items():
+            self.history.observe(user, now)
+            if creator.live:
+                live.append(user)
+            else:
+                offline[user] = math.sqrt(max(self.history.start_rate(user, now, self.window), self.prior))
+
+        # Requests of the live checks and of the slowest offline checks, none can be saved
+        floor = len(live) / self.live_interval + OFFLINE_CHECK_REQUESTS * len(offline) / self.max_interval
+        stretch = max(1.0, floor / self.budget)
+        if stretch > 1 and self.stretch == 1:
+            self.logger.error(f"Live checks of {len(creators)} channels exceed the budget of {self.budget} "
+                                f"requests per second, polling {stretch:.1f} times less often")
+        self.stretch = stretch
+
+        cost = 0.0
+        for user in live:
+            self.intervals[user] = self.live_interval * stretch
+            cost += 1 / self.intervals[user]
+        budget = max(self.budget - cost, 0.0)
+        # Intervals of the history alone, shortened by the budget never
+        scale = min(1 / (self.min_interval * math.sqrt(self.dense_rate)), self.solve(offline.values(), budget))
+        for user, weight in offline.items():
+            self.intervals[user] = 1 / self.clamp(scale * weight)
+        for user in set(self.intervals) - set(creators):
+            del self.intervals[user]
+
+        self.planned_rate = cost + sum(OFFLINE_CHECK_REQUESTS / self.intervals[user] for user in offline)
+        self.planned_at = now
+
+    def clamp(self, frequency):
+        return min(max(frequency, 1 / (self.max_interval * self.stretch)), 1 / self.min_interval)
+
+    def solve(self, weights, budget):
+        """
+        Scale of the check frequencies, proportional to weights within
+        [1 / stretched max_interval, 1 / min_interval], costing budget requests per
+        second. The clamped frequencies make the cost non-linear, it is
+        found by bisection.
+        """
+        weights = list(weights)
+        if not weights:
+            return 0.0
+
+        def cost(scale):
+            return sum(OFFLINE_CHECK_REQUESTS * self.clamp(scale * weight) for weight in weights)
+
+        low, high = 0.0, 1.0
+        while cost(high) < budget and high < 1e12:
+            high *= 2
+        for _ in range(60):
+            middle = (low + high) / 2
+            if cost(middle) < budget:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def stats(self):
+        return {"budget": self.budget, "planned_rate": round(self.planned_rate, 4), "stretch": round(self.stretch, 3)}
@@ -0,0 +1,213 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tiktok import room_url, live_detail_url, parse_room_id, parse_is_live
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every poll: at most rate requests per second
+    on average, with bursts of up to burst requests.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Creator:
+    """
+    Live status of one polled username.
+    live is None until the first successful check.
+    """
+
+    def __init__(self, user, room_id=None):
+        self.user = user
+        self.room_id = room_id
+        self.live = None
+        self.checks = 0
+        self.failures = 0
+        self.last_checked = None
+        self.last_change = None
+
+    def stats(self):
+        return {
+            "room_id": self.room_id,
+            "live": self.live,
+            "checks": self.checks,
+            "failures": self.failures,
+            "last_checked": self.last_checked,
+            "last_change": self.last_change,
+        }
+
+
+class LivePoller:
+    """
+    Polls the live status of many usernames from one event loop.
+    Every creator has its own jittered schedule, the requests of all of them
+    share a rate limiter and at most concurrency of them are in flight.
+    The requests go through the shared pooled session in a thread pool of
+    the same size, so no additional HTTP stack is needed.
+
+    Listeners are called on the event loop with (creator, live) on every
+    transition, including the first status found for a creator.
+    With an AdaptiveSchedule, the interval of every creator is planned from
+    its live history instead.
+    """
+
+    def __init__(self, httpclient, logger, interval=60, jitter=0.2, rate=10, burst=5, concurrency=20,
+                 max_backoff=600, cache=None, adaptive=None):
+        self.session = httpclient.req
+        self.logger = logger
+        # Optional RoomCache the room ids found are stored in
+        self.cache = cache
+        self.interval = interval
+        self.jitter = jitter
+        self.limiter = RateLimiter(rate, burst)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='live-poller')
+        self.max_backoff = max_backoff
+        self.creators = {}
+        self.tasks = {}
+        self.listeners = []
+        self.running = False
+        self.adaptive = adaptive
+        if adaptive is not None:
+            self.listeners.append(adaptive.on_status)
+
+    def add(self, user, room_id=None):
+        """
+        Track user, polled from start() on.
+        """
+        if user in self.creators:
+            return self.creators[user]
+        if room_id is None and self.cache is not None:
+            # Checking the cached room first saves scraping the live page
+            room_id = self.cache.get_room_id(user)
+        creator = self.creators[user] = Creator(user, room_id)
+        if self.running:
+            self.schedule(creator)
+        return creator
+
+    def start(self):
+        """
+        Start polling every tracked creator, must be called from the event loop.
+        """
+        self.running = True
+        for creator in self.creators.values():
+            self.schedule(creator)
+        return self
+
+    def stop(self):
+        self.running = False
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        self.executor.shutdown(wait=False)
+
+    def schedule(self, creator):
+        if creator.user not in self.tasks:
+            # Spread the first checks over the interval instead of bursting
+            delay = random.uniform(0, self.next_delay(creator))
+            self.tasks[creator.user] = asyncio.get_running_loop().create_task(self.poll(creator, delay))
+
+    def remove(self, user):
+        self.creators.pop(user, None)
+        task = self.tasks.pop(user, None)
+        if task is not None:
+            task.cancel()
+
+    def next_delay(self, creator):
+        """
+        Jittered delay until the next check, backing off exponentially after failures.
+        """
+        interval = self.interval if self.adaptive is None else self.adaptive.interval(creator, self.creators)
+        delay = interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if creator.failures:
+            # Never sooner than planned, a planned interval may exceed max_backoff
+            delay = max(delay, min(self.max_backoff, delay * 2 ** creator.failures))
+        return delay
+
+    async def poll(self, creator, delay):
+        while True:
+            await asyncio.sleep(delay)
+            await self.check(creator)
+            delay = self.next_delay(creator)
+
+    async def check(self, creator):
+        """
+        Check creator once and emit an event if its live status changed.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            live = False
+            if creator.room_id is not None:
+                live = parse_is_live(await self.fetch(loop, live_detail_url(creator.room_id)))
+
+            if not live:
+                # A new live gets a new room, look it up again while offline
+                room_id = parse_room_id(await self.fetch(loop, room_url(creator.user), allow_redirects=False))
+                if room_id is not None and room_id != creator.room_id:
+                    creator.room_id = room_id
+                    if self.cache is not None:
+                        self.cache.set_room_id(creator.user, room_id)
+                    live = parse_is_live(await self.fetch(loop, live_detail_url(room_id)))
+        except Exception as ex:
+            creator.failures += 1
+            self.logger.error(f"Live check of {creator.user} failed: {ex}")
+            return
+
+        creator.checks += 1
+        creator.failures = 0
+        creator.last_checked = time.time()
+        if live != creator.live:
+            creator.live = live
+            creator.last_change = creator.last_checked
+            for listener in self.listeners:
+                try:
+                    listener(creator, live)
+                except Exception as ex:
+                    self.logger.error(f"Live status listener of {creator.user} failed: {ex}")
+
+    async def fetch(self, loop, url, **kwargs):
+        async with self.semaphore:
+            await self.limiter.acquire()
+            response = await loop.run_in_executor(self.executor, lambda: self.session.get(url, **kwargs))
+            # A rate limited or failed request says nothing about the live status,
+            # neither does a redirect to a captcha or blacklist page
+            response.raise_for_status()
+            if response.is_redirect:
+                raise ValueError(f"Redirected to {response.headers.get('Location')}")
+            return response.text
+
+    async def check_all(self):
+        """
+        Check every creator once, concurrently within the rate limit.
+        """
+        await asyncio.gather(*(self.check(creator) for creator in self.creators.values()))
+
+    def stats(self):
+        stats = {user: creator.stats() for user, creator in self.creators.items()}
+        if self.adaptive is not None:
+            for user in stats:
+                stats[user].update(self.adaptive.history.stats(user))
+                if user in self.adaptive.intervals:
+                    stats[user]["interval"] = round(self.adaptive.intervals[user], 1)
+        return stats
+
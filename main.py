@@ -1,8 +1,24 @@
 import atexit
+import inspect
+import os
+import sys
+
+# The vendored Flask and werkzeug come first: the dev server of this werkzeug
+# writes scatter-gather bodies and has the pool, keep-alive and SO_REUSEPORT modes
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libs'))
+
 import yaml
+from werkzeug.serving import run_simple
 from httpclient import HttpClient
 import logger_manager
 from tiktok import TikTok
+from channel import Channel
+from server import create_app
+from stream_server import StreamServer
+from scheduler import ChannelScheduler
+from room_cache import RoomCache
+from supervisor import Supervisor
+from listener_processes import ListenerProcesses
 
 yaml_file_path = 'config.yaml'
 
@@ -12,11 +28,10 @@ def config_properties():
         data = yaml.safe_load(yaml_file)
 
     # Access values from the YAML data
-    channel_name = data['channel']['name']
-    channel_id = data['channel']['id']
-    channel_url = data['channel']['url']
-    proxy = data['proxy']
-    return channel_name, channel_id, proxy, channel_url
+    channels = data.get('channels') or [data['channel']]
+    proxy = data.get('proxy')
+    server = data.get('server') or {}
+    return channels, proxy, server, data
 
 
 def cleanup(httpclient, logger):
@@ -25,34 +40,116 @@ def cleanup(httpclient, logger):
         logger.info("HTTP session closed")
 
 
+def server_options(server, logger):
+    """
+    Keyword arguments of app.run for the dev server modes enabled in the
+    config, left out when disabled. Only the vendored werkzeug knows them,
+    a mode the running one does not support is dropped with an error.
+    """
+    options = {}
+    if server.get('pool_size'):
+        options.update(pool_size=server['pool_size'], pool_queue_size=server.get('pool_queue_size', 64))
+    if server.get('keep_alive'):
+        options.update(keep_alive=True, keep_alive_timeout=server.get('keep_alive_timeout', 5))
+    if server.get('reuse_port_processes', 0) > 1:
+        options.update(reuse_port_processes=server['reuse_port_processes'])
+
+    supported = inspect.signature(run_simple).parameters
+    for name in [name for name in options if name not in supported]:
+        logger.error(f"server.{name} is not supported by this werkzeug, it is ignored")
+        del options[name]
+    return options
+
+
+def start_listener(pipelines, httpclient, server, settings, logger, cache=None, reuse_port=False):
+    if reuse_port:
+        # Connections pooled before the fork must not be shared between processes
+        httpclient.configure_session()
+        if cache is not None:
+            cache.reopen()
+
+    if server.get('stream_port'):
+        # Viewers stream from the event loop, Flask keeps the control routes
+        StreamServer(pipelines, server.get('host', '0.0.0.0'), server['stream_port'],
+                     timeout=settings.get('stall_timeout', 5), reuse_port=reuse_port).start()
+        logger.info(f"Streaming on port {server['stream_port']}")
+
+
 def main():
-    url = None
-    user = None
-    mode = None
-    room_id = None
-    proxy = None
-    use_ffmpeg = None
     httpclient = None
 
     print("Starting Stream")
-    user, room_id, proxy, url = config_properties()
+    channels, proxy, server, settings = config_properties()
 
     # setup logging
     logger = logger_manager.LoggerManager()
 
-    httpclient = HttpClient(logger)
+    # One HTTP session shared by every channel
+    httpclient = HttpClient.from_settings(logger, settings)
 
     # Register the cleanup function to run when the program exits
     atexit.register(cleanup, httpclient, logger)
 
     try:
-        bot = TikTok(
-            httpclient=httpclient,
-            logger=logger,
-            room_id=room_id,
-            user=user,
-            url=url)
-        bot.run()
+        # Room ids and pull urls of the previous runs
+        cache = RoomCache(**settings['cache']) if settings.get('cache') else None
+
+        for channel in channels:
+            if not channel.get('name'):
+                logger.error(f"Channel {channel.get('url') or channel.get('id')} has no name, it is not scheduled")
+        channels = [channel for channel in channels if channel.get('name')]
+
+        if settings.get('workers'):
+            # Channels are spread over worker processes behind this front server,
+            # each one is placed on a worker while it is live
+            supervisor = Supervisor(channels, settings, logger, workers=settings['workers'],
+                                    base_port=settings.get('worker_base_port', 5100)).start(assign=False)
+            scheduler = ChannelScheduler(
+                httpclient, logger, channels, settings,
+                start_pipeline=lambda channel, room_id: supervisor.place(channel['name'], room_id),
+                stop_pipeline=lambda channel: supervisor.unassign(channel['name']),
+                cache=cache).start()
+            app = supervisor.create_app(scheduler)
+            app.run(host=server.get('host', '0.0.0.0'), port=server.get('port', 5000), debug=False, threaded=True,
+                    **server_options(server, logger))
+            return
+
+        pipelines = {}
+
+        def start_pipeline(channel, room_id):
+            bot = TikTok(
+                httpclient=httpclient,
+                logger=logger,
+                room_id=room_id or channel.get('id'),
+                user=channel['name'],
+                url=channel.get('url'),
+                cache=cache)
+            logger.info(f"{bot.user} is live, we can get the stream this is the chanel if {bot.room_id}")
+            pipelines[bot.user] = Channel(bot, settings).start()
+
+        def stop_pipeline(channel):
+            pipeline = pipelines.pop(channel['name'], None)
+            if pipeline is not None:
+                pipeline.stop()
+
+        options = server_options(server, logger)
+        if options.get('reuse_port_processes'):
+            # One scheduler in this process polls the creators, every listener
+            # process runs the pipelines it starts, from right after its fork
+            listeners = ListenerProcesses(logger, start_pipeline, stop_pipeline, lambda: start_listener(
+                pipelines, httpclient, server, settings, logger, cache, reuse_port=True)).install()
+            ChannelScheduler(httpclient, logger, channels, settings, listeners.start, listeners.stop, cache).start()
+            # The listeners only have a copy of the scheduler as it was when they were forked
+            scheduler = None
+        else:
+            scheduler = ChannelScheduler(httpclient, logger, channels, settings, start_pipeline, stop_pipeline,
+                                         cache).start()
+            start_listener(pipelines, httpclient, server, settings, logger, cache)
+
+        # One HTTP server for all the channels, whether they are live or not
+        app = create_app(pipelines, scheduler)
+        app.run(host=server.get('host', '0.0.0.0'), port=server.get('port', 5000), debug=False, threaded=True,
+                **options)
     except Exception as ex:
         logger.error(f'Exception caught in main:\n{ex}')
     finally:
@@ -0,0 +1,158 @@
+import sqlite3
+import time
+from threading import Thread, Lock, Condition
+from urllib.parse import urlsplit, parse_qs
+
+# Query parameters carrying the expiry (unix time) of a signed CDN url
+EXPIRY_PARAMS = ('expire', 'x-expires', 'expires')
+
+
+def url_expiry(url):
+    """
+    Expiry time embedded in a signed pull url, None if it has none.
+    """
+    query = parse_qs(urlsplit(url).query)
+    for param in EXPIRY_PARAMS:
+        values = query.get(param)
+        if values and values[0].isdigit():
+            return float(values[0])
+    return None
+
+
+class RoomCache:
+    """
+    On-disk cache of username -> room_id and room_id -> pull url, shared by
+    the channels, the worker processes and the next runs of the server.
+
+    Room ids are kept for room_ttl seconds. Pull urls are kept until the
+    expiry signed into them (url_ttl seconds when they carry none), and the
+    watched ones are fetched again in the background refresh_margin seconds
+    before they expire.
+    """
+
+    def __init__(self, path='cache.sqlite3', room_ttl=6 * 3600, url_ttl=600, refresh_margin=120,
+                 min_refresh_interval=30):
+        self.path = path
+        self.room_ttl = room_ttl
+        self.url_ttl = url_ttl
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self.reopen()
+
+    def reopen(self):
+        """
+        Open the database, again in a forked process: neither the sqlite
+        connection nor the refresh thread survive a fork.
+        """
+        self.lock = Lock()
+        self.db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        # Several worker processes may share the file
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS rooms (user TEXT PRIMARY KEY, room_id TEXT, updated REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS live_urls (room_id TEXT PRIMARY KEY, url TEXT, expires REAL)')
+
+        # room_id -> callable() returning a fresh pull url, refreshed in the background
+        self.watched = {}
+        self.refreshed_at = {}
+        self.condition = Condition(self.lock)
+        self.running = False
+        self.thread = None
+
+    def query(self, sql, *args):
+        with self.lock:
+            return self.db.execute(sql, args).fetchone()
+
+    def count(self, row):
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def get_room_id(self, user):
+        row = self.count(self.query('SELECT room_id FROM rooms WHERE user = ? AND updated > ?',
+                                    user, time.time() - self.room_ttl))
+        return row[0] if row else None
+
+    def set_room_id(self, user, room_id):
+        if user and room_id:
+            self.query('INSERT OR REPLACE INTO rooms VALUES (?, ?, ?)', user, room_id, time.time())
+
+    def get_live_url(self, room_id):
+        """
+        Cached pull url of room_id, None if there is none or it expires within refresh_margin.
+        """
+        row = self.count(self.query('SELECT url FROM live_urls WHERE room_id = ? AND expires > ?',
+                                    room_id, time.time() + self.refresh_margin))
+        return row[0] if row else None
+
+    def set_live_url(self, room_id, url):
+        if not room_id or not url:
+            return
+        expires = url_expiry(url) or time.time() + self.url_ttl
+        self.query('INSERT OR REPLACE INTO live_urls VALUES (?, ?, ?)', room_id, url, expires)
+        with self.condition:
+            self.condition.notify_all()
+
+    def invalidate_live_url(self, room_id):
+        self.query('DELETE FROM live_urls WHERE room_id = ?', room_id)
+
+    def watch(self, room_id, fetch):
+        """
+        Keep the pull url of room_id fresh in the background with fetch().
+        A room is unwatched once fetch() returns no url (the live ended).
+        """
+        with self.condition:
+            self.watched[room_id] = fetch
+            if not self.running:
+                self.running = True
+                self.thread = Thread(target=self.refresh, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def unwatch(self, room_id):
+        with self.condition:
+            self.watched.pop(room_id, None)
+            self.refreshed_at.pop(room_id, None)
+
+    def refresh(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                rooms = list(self.watched.items())
+                due, next_refresh = [], time.time() + self.url_ttl
+                for room_id, fetch in rooms:
+                    row = self.db.execute('SELECT expires FROM live_urls WHERE room_id = ?', (room_id,)).fetchone()
+                    # Never fetch the same room in a loop, e.g. when its urls are short-lived
+                    refresh_at = max((row[0] if row else 0) - self.refresh_margin,
+                                     self.refreshed_at.get(room_id, 0) + self.min_refresh_interval)
+                    if refresh_at <= time.time():
+                        due.append((room_id, fetch))
+                    else:
+                        next_refresh = min(next_refresh, refresh_at)
+                if not due:
+                    self.condition.wait(max(1.0, next_refresh - time.time()))
+                    continue
+
+            for room_id, fetch in due:
+                self.refreshed_at[room_id] = time.time()
+                try:
+                    url = fetch()
+                except Exception:
+                    # Transient failure, retried after min_refresh_interval
+                    continue
+                if url:
+                    self.set_live_url(room_id, url)
+                else:
+                    self.unwatch(room_id)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "watched": len(self.watched)}
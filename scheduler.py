@@ -0,0 +1,156 @@
+import asyncio
+import time
+from threading import Thread
+from live_poller import LivePoller
+from live_history import AdaptiveSchedule
+
+STATE_OFFLINE = 'offline'
+STATE_STARTING = 'starting'
+STATE_LIVE = 'live'
+STATE_ENDED = 'ended'
+
+
+class ScheduledChannel:
+    """
+    Lifecycle state and metrics of one configured channel.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.name = config['name']
+        self.state = STATE_OFFLINE
+        self.since = time.monotonic()
+        self.transitions = 0
+        self.starts = 0
+        self.failures = 0
+        self.live_time = 0.0
+        self.last_live = None
+
+    def stats(self):
+        live_time = self.live_time
+        if self.state == STATE_LIVE:
+            live_time += time.monotonic() - self.since
+        return {
+            "state": self.state,
+            "in_state_for": round(time.monotonic() - self.since, 3),
+            "transitions": self.transitions,
+            "starts": self.starts,
+            "failures": self.failures,
+            "live_time": round(live_time, 3),
+            "last_live": self.last_live,
+        }
+
+
+class ChannelScheduler:
+    """
+    Drives every configured channel through offline -> starting -> live ->
+    ended -> offline, following the live status found by a LivePoller.
+    Offline channels only cost their periodic live checks, a pipeline only
+    runs while its creator is live.
+
+    start_pipeline(config, room_id) and stop_pipeline(config) build and tear
+    down the pipeline of a channel, they block and run in the executor.
+    Listeners are called with (channel, old state, new state) on every transition.
+    """
+
+    def __init__(self, httpclient, logger, channels, settings, start_pipeline, stop_pipeline, cache=None):
+        self.httpclient = httpclient
+        self.logger = logger
+        self.settings = settings
+        self.cache = cache
+        self.start_pipeline = start_pipeline
+        self.stop_pipeline = stop_pipeline
+        self.channels = {channel['name']: ScheduledChannel(channel) for channel in channels}
+        self.listeners = []
+        self.poller = None
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        thread = Thread(target=self.loop.run_until_complete, args=(self.run(),))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    async def run(self):
+        # Opened here, in the process the scheduler runs in
+        adaptive = self.settings.get('adaptive_polling')
+        adaptive = AdaptiveSchedule(self.logger, **adaptive) if adaptive else None
+        self.poller = LivePoller(self.httpclient, self.logger, cache=self.cache, adaptive=adaptive,
+                                 **(self.settings.get('poller') or {}))
+        self.poller.listeners.append(self.on_status)
+        for name, scheduled in self.channels.items():
+            self.poller.add(name, scheduled.config.get('id'))
+
+        # Every channel is checked right away, then on its own schedule
+        await self.poller.check_all()
+        self.poller.start()
+        await asyncio.Event().wait()
+
+    def on_status(self, creator, live):
+        scheduled = self.channels.get(creator.user)
+        if scheduled is None:
+            return
+        # A channel in the middle of a transition is checked again once it is done
+        if live and scheduled.state == STATE_OFFLINE:
+            self.loop.create_task(self.go_live(scheduled, creator))
+        elif not live and scheduled.state == STATE_LIVE:
+            self.loop.create_task(self.end(scheduled, creator))
+
+    def transition(self, scheduled, state):
+        old_state = scheduled.state
+        now = time.monotonic()
+        if old_state == STATE_LIVE:
+            scheduled.live_time += now - scheduled.since
+        scheduled.state = state
+        scheduled.since = now
+        scheduled.transitions += 1
+        self.logger.info(f"{scheduled.name}: {old_state} -> {state}")
+        for listener in self.listeners:
+            try:
+                listener(scheduled, old_state, state)
+            except Exception as ex:
+                self.logger.error(f"Transition hook of {scheduled.name} failed: {ex}")
+
+    async def go_live(self, scheduled, creator):
+        self.transition(scheduled, STATE_STARTING)
+        scheduled.starts += 1
+        try:
+            await self.loop.run_in_executor(None, self.start_pipeline, scheduled.config, creator.room_id)
+        except Exception as ex:
+            scheduled.failures += 1
+            self.logger.error(f"Unable to start {scheduled.name}: {ex}")
+            self.transition(scheduled, STATE_OFFLINE)
+            # Forget the status, so the next check reports the channel live again
+            creator.live = None
+            return
+
+        scheduled.last_live = time.time()
+        self.transition(scheduled, STATE_LIVE)
+        if creator.live is False:
+            # The live ended while the pipeline was starting
+            await self.end(scheduled, creator)
+
+    async def end(self, scheduled, creator):
+        self.transition(scheduled, STATE_ENDED)
+        try:
+            await self.loop.run_in_executor(None, self.stop_pipeline, scheduled.config)
+        except Exception as ex:
+            self.logger.error(f"Unable to stop {scheduled.name}: {ex}")
+        self.transition(scheduled, STATE_OFFLINE)
+        if creator.live:
+            # Live again while the pipeline was being torn down
+            await self.go_live(scheduled, creator)
+
+    def stats(self):
+        channels = {name: scheduled.stats() for name, scheduled in self.channels.items()}
+        stats = {
+            "live": sum(1 for scheduled in self.channels.values() if scheduled.state == STATE_LIVE),
+            "channels": channels,
+        }
+        if self.poller is not None:
+            for name, poll in self.poller.stats().items():
+                channels[name]["poll"] = poll
+            if self.poller.adaptive is not None:
+                stats["polling"] = self.poller.adaptive.stats()
+        return stats
@@ -0,0 +1,220 @@
+from flask import Flask, Response, request, jsonify, abort
+from werkzeug.http import generate_etag, is_resource_modified, quote_etag
+from viewers import Viewer
+from flv_relay import generate_flv
+from hls_segmenter import generate_segment
+
+PART_TRAILER = b'\r\n'
+
+# Upstream frames a snapshot may lag behind, the cadence of the MJPEG viewers
+SNAPSHOT_MAX_LAG = 5
+
+
+def mjpeg_part(part_header, frame_bytes, scatter_gather):
+    """
+    One MJPEG part: the buffers of a scatter-gather write, or their copy in one bytes object.
+    """
+    if scatter_gather:
+        return part_header, memoryview(frame_bytes), PART_TRAILER
+    return b''.join((part_header, frame_bytes, PART_TRAILER))
+
+
+def scatter_gather_supported():
+    """
+    Whether the server running the request writes sequences of buffers, the
+    patched werkzeug dev server advertises it in the environ.
+    """
+    return request.environ.get('werkzeug.scatter_gather', False)
+
+
+def generate_frames(threaded_camera, viewer, registry, logger, timeout=5, scatter_gather=True):
+    """
+    Generate frames for streaming.
+    Starts with the last encoded frame, then blocks until a newer frame is
+    published instead of polling, so a frame is never sent twice and every
+    skip_frames-th upstream frame is delivered.
+    A client that stays behind for longer than the registry timeout is evicted.
+    Without scatter_gather every part is joined into one bytes object, the
+    only body item a standard WSGI server accepts.
+    """
+    threaded_camera.subscribe(viewer.rendition, viewer.skip_frames)
+    registry.add(viewer)
+    try:
+        # The response headers go out right away, followed by the last encoded
+        # frame so the viewer never waits for the next decode to see a picture
+        yield b''
+        seq, frame_bytes, part_header = threaded_camera.get_ready_part(viewer.rendition)
+        if frame_bytes:
+            if seq == threaded_camera.frame_seq:
+                viewer.deliver(seq)
+            yield mjpeg_part(part_header, frame_bytes, scatter_gather)
+            if not threaded_camera.is_current(seq):
+                logger.info(f"Disconnecting viewer {viewer.address}, frame {seq} was overwritten while sent")
+                return
+
+        while True:
+            latest_seq = threaded_camera.wait_for_frame(viewer.next_seq(), timeout)
+            if viewer.is_behind(latest_seq) and registry.should_evict(viewer):
+                logger.info(f"Evicting slow viewer {viewer.address}, {viewer.lag():.1f}s behind")
+                break
+
+            if latest_seq is None:
+                if not threaded_camera.running:
+                    # The channel was stopped, its live ended
+                    break
+                # Upstream stalled, keep waiting without resending the last frame
+                continue
+
+            seq, frame_bytes, part_header = threaded_camera.get_encoded_part(viewer.rendition)
+            viewer.deliver(seq)
+
+            # Written by the server as one scatter-gather write, the jpeg is never copied
+            yield mjpeg_part(part_header, frame_bytes, scatter_gather)
+            if not threaded_camera.is_current(seq):
+                # A frame bus slot reused during the write, the viewer got a torn jpeg
+                logger.info(f"Disconnecting viewer {viewer.address}, frame {seq} was overwritten while sent")
+                break
+
+    except Exception as e:
+        # Log any exceptions that might occur during frame generation
+        logger.error(f"Error in generate_frames: {e}")
+    finally:
+        registry.remove(viewer)
+        threaded_camera.unsubscribe(viewer.rendition, viewer.skip_frames)
+
+
+def create_app(channels, scheduler=None):
+    """
+    Build the Flask app serving every channel under /<channel>/.
+    channels maps the channel name to its running Channel, the optional
+    ChannelScheduler adds and removes them as their lives start and end.
+    """
+    app = Flask(__name__)
+
+    def get_channel(name, component):
+        channel = channels.get(name)
+        if channel is None or getattr(channel, component) is None:
+            abort(404)
+        return channel
+
+    @app.route('/<name>/mjpeg')
+    def mjpeg(name):
+        channel = get_channel(name, 'camera')
+        threaded_camera = channel.camera
+
+        # ?res=<height> picks a rendition of the ladder, default is the source resolution
+        rendition = threaded_camera.select_rendition(request.args.get('res', type=int))
+        viewer = Viewer(request.remote_addr, rendition, skip_frames=5)
+
+        # A write blocked on a stuck socket must not pin the handler thread forever
+        sock = request.environ.get('werkzeug.socket')
+        if sock is not None and channel.viewers.timeout:
+            sock.settimeout(channel.viewers.timeout)
+
+        return Response(generate_frames(threaded_camera, viewer, channel.viewers, channel.logger,
+                                        scatter_gather=scatter_gather_supported()),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @app.route('/<name>/snapshot.jpg')
+    def snapshot(name):
+        threaded_camera = get_channel(name, 'camera').camera
+        rendition = threaded_camera.select_rendition(request.args.get('res', type=int))
+
+        def frame_etag(seq):
+            return generate_etag(f'{threaded_camera.epoch}-{rendition}-{seq}'.encode())
+
+        # Subscribing wakes a hibernating capture up and gets a frame decoded at
+        # the MJPEG cadence, a snapshot accepts one up to SNAPSHOT_MAX_LAG grabs old
+        threaded_camera.subscribe(rendition, SNAPSHOT_MAX_LAG)
+        try:
+            # Without viewers the last decoded frame may be old, wait for a recent one
+            min_seq = max(1, threaded_camera.grabbed - SNAPSHOT_MAX_LAG)
+            latest_seq = threaded_camera.wait_for_frame(min_seq, threaded_camera.stall_timeout)
+            if latest_seq is None:
+                abort(503)
+
+            # ?wait=next long-polls for a frame newer than the latest one,
+            # unless the If-None-Match of the client is already outdated
+            if request.args.get('wait') == 'next' and not (
+                    request.if_none_match and is_resource_modified(request.environ, frame_etag(latest_seq))):
+                threaded_camera.wait_for_frame(latest_seq + 1, threaded_camera.stall_timeout)
+
+            # The jpeg is the one shared with the MJPEG viewers of the rendition
+            seq, frame_bytes = threaded_camera.get_encoded_frame(rendition)
+        finally:
+            threaded_camera.unsubscribe(rendition, SNAPSHOT_MAX_LAG)
+
+        etag = frame_etag(seq)
+        headers = {'Cache-Control': 'no-cache', 'ETag': quote_etag(etag)}
+        if not is_resource_modified(request.environ, etag):
+            return Response(status=304, headers=headers)
+        return Response(frame_bytes, mimetype='image/jpeg', headers=headers)
+
+    @app.route('/<name>/live.flv')
+    def live_flv(name):
+        relay = get_channel(name, 'relay').relay
+        return Response(generate_flv(relay, scatter_gather=scatter_gather_supported()), mimetype='video/x-flv')
+
+    @app.route('/<name>/hls/live.m3u8')
+    def hls_playlist(name):
+        segmenter = get_channel(name, 'segmenter').segmenter
+        if not segmenter.playlist:
+            abort(404)
+        return Response(segmenter.playlist, mimetype='application/vnd.apple.mpegurl',
+                        headers={'Cache-Control': 'max-age=1'})
+
+    @app.route('/<name>/hls/init.mp4')
+    def hls_init(name):
+        segmenter = get_channel(name, 'segmenter').segmenter
+        if not segmenter.init_segment:
+            abort(404)
+        return Response(segmenter.init_segment, mimetype='video/mp4',
+                        headers={'Cache-Control': 'public, max-age=3600'})
+
+    @app.route('/<name>/hls/<int:seq>.m4s')
+    def hls_segment(name, seq):
+        segmenter = get_channel(name, 'segmenter').segmenter
+        segment = segmenter.get_segment(seq)
+        if segment is None:
+            abort(404)
+
+        part = request.args.get('part', type=int)
+        if part is not None:
+            chunk = segmenter.get_part(segment, part, segmenter.segment_duration * 2)
+            if chunk is None:
+                abort(404)
+            return Response(chunk, mimetype='video/mp4',
+                            headers={'Cache-Control': 'public, max-age=3600, immutable'})
+
+        # Segments never change once published, the one being written is
+        # sent chunk by chunk with chunked transfer encoding
+        body = segment.data if segment.complete else generate_segment(segmenter, segment,
+                                                                      scatter_gather=scatter_gather_supported())
+        return Response(body, mimetype='video/mp4',
+                        headers={'Cache-Control': 'public, max-age=3600, immutable'})
+
+    @app.route('/')
+    def index():
+        # Single channel setups keep their MJPEG stream on /
+        if not channels:
+            abort(404)
+        return mjpeg(next(iter(channels)))
+
+    @app.route('/snapshot.jpg')
+    def index_snapshot():
+        if not channels:
+            abort(404)
+        return snapshot(next(iter(channels)))
+
+    @app.route('/status')
+    def status():
+        # Channels come and go with the scheduler
+        return jsonify({name: channel.stats() for name, channel in list(channels.items())})
+
+    @app.route('/scheduler')
+    def scheduler_status():
+        if scheduler is None:
+            abort(404)
+        return jsonify(scheduler.stats())
+
+    return app
@@ -0,0 +1,205 @@
+import asyncio
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs
+from viewers import Viewer
+from server import PART_TRAILER
+
+MJPEG_HEADERS = (b'HTTP/1.1 200 OK\r\n'
+                 b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                 b'Cache-Control: no-cache\r\n'
+                 b'Connection: close\r\n\r\n')
+
+
+class Feed:
+    """
+    Latest encoded frame of one rendition of a camera, on the event loop.
+    The capture thread only signals new frames, the frame is encoded once
+    in the executor and shared by every viewer of the rendition.
+    """
+
+    def __init__(self, camera, rendition):
+        self.camera = camera
+        self.rendition = rendition
+        self.viewers = 0
+        # Called by the capture thread on every published frame
+        self.listener = None
+        # The first viewers get the last encoded frame without waiting for the next one
+        self.latest = self.own(camera.get_ready_part(rendition))
+        self.published = asyncio.Event()
+        self.condition = asyncio.Condition()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def refresh(self):
+        """
+        Forget the last frame once the camera released the upstream, it
+        may be hours old when the capture resumes.
+        """
+        if self.latest[0] and not self.camera.get_ready_part(self.rendition)[0]:
+            self.latest = (0, b'', b'')
+
+    def frame_ready(self):
+        if self.viewers:
+            self.published.set()
+
+    def own(self, part):
+        """
+        Copy the jpeg of a frame bus slot, which is overwritten while the feed
+        may still be sending it. Encoded bytes of a local camera are shared as is.
+        """
+        seq, frame_bytes, part_header = part
+        if isinstance(frame_bytes, memoryview):
+            frame_bytes = bytes(frame_bytes)
+            if not self.camera.is_current(seq):
+                # Torn while copied, the next frame is already written
+                return 0, b'', b''
+        return seq, frame_bytes, part_header
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.published.wait()
+            self.published.clear()
+            part = self.own(await loop.run_in_executor(None, self.camera.get_encoded_part, self.rendition))
+            if part[0] > self.latest[0]:
+                async with self.condition:
+                    self.latest = part
+                    self.condition.notify_all()
+
+    async def wait_for_frame(self, min_seq, timeout=None):
+        """
+        Wait until a frame with a sequence number >= min_seq is encoded.
+        Return the latest sequence number, or None if the timeout expired first.
+        """
+        try:
+            async with self.condition:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.latest[0] >= min_seq), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.latest[0]
+
+
+class StreamServer:
+    """
+    Asyncio front end serving the MJPEG streams of every channel from a
+    single event loop, a viewer costs a coroutine instead of a thread.
+    The Flask app keeps serving the control and status routes.
+    """
+
+    def __init__(self, channels, host='0.0.0.0', port=5001, timeout=5, backlog=1024, reuse_port=False):
+        self.channels = channels
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.backlog = backlog
+        # Several processes may serve the same port, see server.reuse_port_processes
+        self.reuse_port = reuse_port
+        self.loop = None
+        self.feeds = {}
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        thread = Thread(target=self.loop.run_until_complete, args=(self.serve(),))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=self.backlog,
+                                            reuse_port=self.reuse_port or None)
+        asyncio.get_running_loop().create_task(self.reap())
+        async with server:
+            await server.serve_forever()
+
+    def get_feed(self, camera, rendition):
+        self.prune()
+        feed = self.feeds.get((camera, rendition))
+        if feed is None:
+            feed = self.feeds[camera, rendition] = Feed(camera, rendition)
+            feed.listener = lambda seq: self.loop.call_soon_threadsafe(feed.frame_ready)
+            camera.listeners.append(feed.listener)
+        return feed
+
+    def prune(self):
+        """
+        Drop the feeds of stopped cameras without viewers, the camera of a
+        stopped channel never comes back.
+        """
+        for key, feed in list(self.feeds.items()):
+            if not feed.viewers and not feed.camera.running:
+                feed.task.cancel()
+                feed.camera.listeners.remove(feed.listener)
+                del self.feeds[key]
+
+    async def reap(self, interval=30):
+        # Channels stop whether or not anybody still watches them
+        while True:
+            await asyncio.sleep(interval)
+            self.prune()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+            method, target, _ = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+            url = urlsplit(target)
+            parts = url.path.strip('/').split('/')
+
+            # /<name>/mjpeg, single channel setups keep their stream on /
+            if url.path == '/' and self.channels:
+                channel = next(iter(self.channels.values()))
+            elif len(parts) == 2 and parts[1] == 'mjpeg':
+                channel = self.channels.get(parts[0])
+            else:
+                channel = None
+
+            if method != 'GET' or channel is None or channel.camera is None:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+                return
+
+            res = parse_qs(url.query).get('res')
+            rendition = channel.camera.select_rendition(int(res[0]) if res and res[0].isdigit() else None)
+            address = writer.get_extra_info('peername')
+            viewer = Viewer(address[0] if address else None, rendition, skip_frames=5)
+            await self.stream(channel, viewer, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, channel, viewer, writer):
+        """
+        Async counterpart of server.generate_frames.
+        A viewer waits on the feed of its rendition and always picks the newest
+        frame, drain() applies the backpressure of a slow socket.
+        """
+        camera, registry = channel.camera, channel.viewers
+        feed = self.get_feed(camera, viewer.rendition)
+        feed.refresh()
+        feed.viewers += 1
+        camera.subscribe(viewer.rendition, viewer.skip_frames)
+        registry.add(viewer)
+        try:
+            writer.write(MJPEG_HEADERS)
+            while True:
+                latest_seq = await feed.wait_for_frame(viewer.next_seq(), self.timeout)
+                if viewer.is_behind(latest_seq) and registry.should_evict(viewer):
+                    channel.logger.info(f"Evicting slow viewer {viewer.address}, {viewer.lag():.1f}s behind")
+                    break
+
+                if latest_seq is None:
+                    if not camera.running:
+                        # The channel was stopped, its live ended
+                        break
+                    # Upstream stalled, keep waiting without resending the last frame
+                    continue
+
+                seq, frame_bytes, part_header = feed.latest
+                viewer.deliver(seq)
+                writer.writelines((part_header, frame_bytes, PART_TRAILER))
+                await asyncio.wait_for(writer.drain(), registry.timeout or None)
+        finally:
+            registry.remove(viewer)
+            camera.unsubscribe(viewer.rendition, viewer.skip_frames)
+            feed.viewers -= 1
+            self.prune()
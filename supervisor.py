@@ -0,0 +1,326 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+from threading import Thread, Lock
+from urllib.parse import parse_qs
+
+from flask import Flask, jsonify, redirect, abort, request
+from werkzeug.middleware.http_proxy import ProxyMiddleware
+
+import logger_manager
+from httpclient import HttpClient
+from room_cache import RoomCache
+from tiktok import TikTok
+from channel import Channel
+from framebus import FrameBus, SharedChannel
+from server import create_app
+
+
+def run_worker(index, port, commands, reports, settings, report_interval):
+    """
+    Entry point of a worker process: serves the channels the supervisor
+    assigns to it on its own port, and reports its load back.
+    """
+    logger = logger_manager.LoggerManager()
+    httpclient = HttpClient.from_settings(logger, settings)
+    cache = RoomCache(**settings['cache']) if settings.get('cache') else None
+    channels = {}
+    buses = {}
+
+    app = create_app(channels)
+    Thread(target=app.run, kwargs={'host': '127.0.0.1', 'port': port, 'threaded': True}, daemon=True).start()
+
+    last_wall, last_cpu = time.monotonic(), time.process_time()
+    while True:
+        try:
+            command, channel = commands.get(timeout=report_interval)
+            if command == 'add':
+                start_channel(channel, channels, httpclient, logger, settings, cache)
+                if channel.get('bus') and channel['name'] in channels:
+                    buses[channel['name']] = publish_channel(channels[channel['name']], channel['bus'], settings)
+            elif command == 'remove' and channel['name'] in channels:
+                pipeline = channels.pop(channel['name'])
+                if buses.pop(channel['name'], None) is not None:
+                    # Closing marks the bus closed, the front viewers of the channel end
+                    pipeline.camera.detach_bus().close()
+                pipeline.stop()
+        except queue.Empty:
+            pass
+        except Exception as ex:
+            logger.error(f"Worker {index}: {ex}")
+
+        now_wall, now_cpu = time.monotonic(), time.process_time()
+        if now_wall - last_wall >= report_interval:
+            # Share of one core used by this process since the last report
+            load = (now_cpu - last_cpu) / (now_wall - last_wall)
+            viewers = {name: channel.viewers.stats()['count'] for name, channel in list(channels.items())}
+            reports.put((index, load, viewers))
+            last_wall, last_cpu = now_wall, now_cpu
+
+
+def start_channel(channel, channels, httpclient, logger, settings, cache=None):
+    """
+    Start the pipeline of a channel, the scheduler already found it live.
+    """
+    bot = TikTok(
+        httpclient=httpclient,
+        logger=logger,
+        room_id=channel.get('id'),
+        user=channel.get('name'),
+        url=channel.get('url'),
+        cache=cache)
+
+    channels[bot.user] = Channel(bot, settings).start()
+
+
+def publish_channel(pipeline, bus_name, settings):
+    """
+    Publish the source rendition of a channel on a new frame bus, read by the front server.
+    """
+    if pipeline.camera is None:
+        return None
+    bus = FrameBus(bus_name, slot_size=settings.get('framebus_slot_size', 4 * 1024 * 1024), create=True)
+    # Every frame an MJPEG viewer would get
+    pipeline.camera.attach_bus(bus, skip_frames=5)
+    return bus
+
+
+class Worker:
+
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self.process = None
+        self.commands = None
+        self.load = 0.0
+        self.viewers = {}
+        self.restarts = 0
+
+
+class Supervisor:
+    """
+    Runs the channels in worker processes, each with its own interpreter so
+    decoding and encoding of different channels never compete for one GIL.
+    The front HTTP server proxies every viewer to the worker serving the
+    channel. Dead workers are restarted with their channels, and a channel
+    is moved away from a worker whose load goes above the saturation level.
+
+    With framebus, every worker publishes the source rendition of its
+    channels on a shared-memory frame bus and the front server streams
+    /<channel>/mjpeg and /<channel>/snapshot.jpg from it instead of proxying.
+    """
+
+    def __init__(self, channels, settings, logger, workers=2, base_port=5100,
+                 report_interval=5, saturation=0.9):
+        self.channels = {channel['name']: channel for channel in channels}
+        self.settings = settings
+        self.logger = logger
+        self.report_interval = report_interval
+        self.saturation = saturation
+        self.workers = [Worker(index, base_port + index) for index in range(workers)]
+        self.assignments = {}
+        self.reports = multiprocessing.Queue()
+        self.lock = Lock()
+        self.front = None
+        self.proxy = None
+        self.framebus = settings.get('framebus', False)
+        # Channel -> name of the frame bus its worker publishes, and SharedChannel read by the front
+        self.buses = {}
+        self.shared = {}
+        self.bus_serial = itertools.count(1)
+
+    def start(self, assign=True):
+        """
+        Spawn the workers and, with assign, spread every channel over them.
+        Without it, channels are placed one by one as they go live.
+        """
+        for worker in self.workers:
+            self.spawn(worker)
+
+        if assign:
+            for position, name in enumerate(self.channels):
+                self.assign(name, self.workers[position % len(self.workers)])
+
+        Thread(target=self.monitor, args=(), daemon=True).start()
+        return self
+
+    def spawn(self, worker):
+        worker.commands = multiprocessing.Queue()
+        worker.process = multiprocessing.Process(
+            target=run_worker,
+            args=(worker.index, worker.port, worker.commands, self.reports, self.settings, self.report_interval),
+            daemon=True)
+        worker.process.start()
+
+    def assign(self, name, worker):
+        with self.lock:
+            self.assignments[name] = worker.index
+            channel = self.command(name)
+            self.update_proxy()
+        worker.commands.put(('add', channel))
+
+    def command(self, name):
+        """
+        Channel config sent to a worker, naming a new frame bus when the front reads one.
+        """
+        channel = self.channels[name]
+        if self.framebus:
+            # Never reused, the bus of a previous assignment may still exist
+            channel = dict(channel, bus=f'tiktok-{os.getpid()}-{next(self.bus_serial)}')
+            self.buses[name] = channel['bus']
+        return channel
+
+    def place(self, name, room_id=None):
+        """
+        Assign a channel to the least loaded worker, the one with the fewest
+        channels when the loads are equal.
+        """
+        if room_id is not None:
+            # Saves the worker looking the room up again
+            self.channels[name] = dict(self.channels[name], id=room_id)
+        with self.lock:
+            counts = {worker.index: 0 for worker in self.workers}
+            for index in self.assignments.values():
+                counts[index] += 1
+        worker = min(self.workers, key=lambda worker: (worker.load, counts[worker.index]))
+        self.assign(name, worker)
+
+    def unassign(self, name):
+        with self.lock:
+            if name not in self.assignments:
+                return
+            worker = self.workers[self.assignments.pop(name)]
+            self.buses.pop(name, None)
+            self.update_proxy()
+        worker.commands.put(('remove', self.channels[name]))
+
+    def update_proxy(self):
+        """
+        Route /<channel>/ to the server of the worker the channel is assigned to.
+        """
+        if self.front is None:
+            return
+        targets = {f'/{name}/': {'target': f'http://127.0.0.1:{self.workers[index].port}/'}
+                   for name, index in self.assignments.items()}
+        self.proxy = ProxyMiddleware(self.front, targets, timeout=60)
+
+    def monitor(self):
+        while True:
+            deadline = time.monotonic() + self.report_interval
+            while time.monotonic() < deadline:
+                try:
+                    index, load, viewers = self.reports.get(timeout=max(0.0, deadline - time.monotonic()))
+                    self.workers[index].load = load
+                    self.workers[index].viewers = viewers
+                except queue.Empty:
+                    break
+
+            for worker in self.workers:
+                if not worker.process.is_alive():
+                    self.restart(worker)
+
+            self.rebalance()
+
+    def restart(self, worker):
+        self.logger.error(f"Worker {worker.index} died, restarting it")
+        worker.restarts += 1
+        self.spawn(worker)
+        with self.lock:
+            names = [name for name, index in self.assignments.items() if index == worker.index]
+            channels = [self.command(name) for name in names]
+        for channel in channels:
+            worker.commands.put(('add', channel))
+
+    def rebalance(self):
+        """
+        Move the channel with the fewest viewers off the busiest worker when
+        that worker is saturated and another one has room for it.
+        """
+        busiest = max(self.workers, key=lambda worker: worker.load)
+        idlest = min(self.workers, key=lambda worker: worker.load)
+        if busiest is idlest or busiest.load < self.saturation or idlest.load >= self.saturation / 2:
+            return
+
+        with self.lock:
+            names = [name for name, index in self.assignments.items() if index == busiest.index]
+        if len(names) < 2:
+            return
+
+        name = min(names, key=lambda channel: busiest.viewers.get(channel, 0))
+        self.logger.info(f"Moving {name} from worker {busiest.index} to worker {idlest.index}")
+        self.unassign(name)
+        self.assign(name, idlest)
+        # Wait for fresh reports before moving anything else
+        busiest.load = idlest.load = 0.0
+
+    def shared_channel(self, name):
+        """
+        SharedChannel reading the frame bus of name, None while its worker has not created it.
+        """
+        with self.lock:
+            bus_name = self.buses.get(name)
+            shared = self.shared.get(name)
+            if bus_name is None:
+                return None
+            if shared is None or shared.bus.name != bus_name:
+                try:
+                    bus = FrameBus(bus_name)
+                except (FileNotFoundError, ValueError):
+                    return None
+                shared = self.shared[name] = SharedChannel(bus, self.logger, self.settings.get('viewer_timeout', 10),
+                                                           self.settings.get('stall_timeout', 5))
+            return shared
+
+    def create_app(self, scheduler=None):
+        """
+        Front app: /status and /scheduler are answered here, every /<channel>/
+        request is proxied to the worker serving that channel.
+        """
+        app = Flask(__name__)
+
+        @app.route('/')
+        def index():
+            if not self.assignments:
+                abort(404)
+            return redirect(f'/{next(iter(self.assignments))}/mjpeg')
+
+        @app.route('/snapshot.jpg')
+        def index_snapshot():
+            if not self.assignments:
+                abort(404)
+            query = request.query_string.decode()
+            return redirect(f'/{next(iter(self.assignments))}/snapshot.jpg' + (f'?{query}' if query else ''), 307)
+
+        @app.route('/status')
+        def status():
+            return jsonify({
+                'assignments': self.assignments,
+                'workers': [{'index': worker.index, 'port': worker.port, 'alive': worker.process.is_alive(),
+                             'load': round(worker.load, 3), 'restarts': worker.restarts,
+                             'viewers': worker.viewers} for worker in self.workers],
+            })
+
+        @app.route('/scheduler')
+        def scheduler_status():
+            if scheduler is None:
+                abort(404)
+            return jsonify(scheduler.stats())
+
+        shared_app = create_app(self.shared)
+
+        def dispatch(environ, start_response):
+            parts = environ.get('PATH_INFO', '').strip('/').split('/')
+            # The bus only carries the source rendition, other renditions are proxied
+            if (self.framebus and len(parts) == 2 and parts[1] in ('mjpeg', 'snapshot.jpg')
+                    and 'res' not in parse_qs(environ.get('QUERY_STRING', ''))
+                    and self.shared_channel(parts[0]) is not None):
+                return shared_app(environ, start_response)
+            return self.proxy(environ, start_response)
+
+        with self.lock:
+            self.front = app.wsgi_app
+            self.update_proxy()
+        app.wsgi_app = dispatch
+        return app
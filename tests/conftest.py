@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same import path as main.py: the modules of the repo, then the vendored Flask and werkzeug
+sys.path.insert(0, os.path.join(ROOT, 'libs'))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,14 @@
+from flv_relay import MAX_TAGS_PER_WRITE, batches
+
+
+def test_batches_stay_within_a_scatter_gather_write():
+    tags = [bytes([index % 256]) for index in range(2 * MAX_TAGS_PER_WRITE + 1)]
+    written = list(batches(tags, True))
+    assert [len(batch) for batch in written] == [MAX_TAGS_PER_WRITE, MAX_TAGS_PER_WRITE, 1]
+    assert [tag for batch in written for tag in batch] == tags
+
+
+def test_batches_are_joined_without_scatter_gather():
+    tags = [b'a', b'b', b'c']
+    assert list(batches(tags, False)) == [b'abc']
+    assert list(batches([], False)) == []
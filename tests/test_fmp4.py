@@ -0,0 +1,134 @@
+import io
+
+import fmp4
+
+
+def u32(value):
+    return value.to_bytes(4, 'big')
+
+
+def box(box_type, payload=b''):
+    return u32(8 + len(payload)) + box_type + payload
+
+
+def full_box(box_type, version, flags, payload):
+    return box(box_type, bytes([version]) + flags.to_bytes(3, 'big') + payload)
+
+
+def trak(track_id, handler, timescale, version=0):
+    times = bytes(16 if version == 1 else 8)
+    tkhd = full_box(b'tkhd', version, 7, times + u32(track_id) + bytes(4) + bytes(8 if version == 1 else 4))
+    mdhd = full_box(b'mdhd', version, 0, times + u32(timescale) + bytes(8 if version == 1 else 4))
+    hdlr = full_box(b'hdlr', 0, 0, bytes(4) + handler + bytes(12))
+    return box(b'trak', tkhd + box(b'mdia', mdhd + hdlr))
+
+
+def trex(track_id, default_duration=0, default_flags=0):
+    return full_box(b'trex', 0, 0, u32(track_id) + u32(1) + u32(default_duration) + u32(0) + u32(default_flags))
+
+
+def init_segment(*traks, mvex=b''):
+    return box(b'ftyp', b'iso5' + u32(512)) + box(b'moov', full_box(b'mvhd', 0, 0, bytes(96)) + b''.join(traks) + mvex)
+
+
+def traf(track_id, durations=(), first_flags=None, sample_flags=None, default_duration=None, default_flags=None):
+    tf_flags = 0
+    tfhd = u32(track_id)
+    if default_duration is not None:
+        tf_flags |= 0x08
+        tfhd += u32(default_duration)
+    if default_flags is not None:
+        tf_flags |= 0x20
+        tfhd += u32(default_flags)
+
+    tr_flags = 0x01
+    trun = u32(len(durations or sample_flags or [0])) + u32(0)
+    if first_flags is not None:
+        tr_flags |= 0x04
+        trun += u32(first_flags)
+    if durations:
+        tr_flags |= 0x100
+    if sample_flags:
+        tr_flags |= 0x400
+    for index in range(len(durations or sample_flags or [0])):
+        if durations:
+            trun += u32(durations[index])
+        if sample_flags:
+            trun += u32(sample_flags[index])
+    return box(b'traf', full_box(b'tfhd', 0, tf_flags, tfhd) + full_box(b'tfdt', 1, 0, bytes(8)) +
+               full_box(b'trun', 0, tr_flags, trun))
+
+
+def moof(*trafs):
+    return box(b'moof', full_box(b'mfhd', 0, 0, u32(1)) + b''.join(trafs))
+
+
+TRACKS = fmp4.parse_init(init_segment(trak(1, b'vide', 90000), trak(2, b'soun', 48000),
+                                      mvex=box(b'mvex', trex(1, 3000, 0x00010000) + trex(2, 1024))))
+
+
+def test_parse_init_reads_the_tracks_and_their_defaults():
+    assert sorted(TRACKS) == [1, 2]
+    video, audio = TRACKS[1], TRACKS[2]
+    assert (video.handler, video.timescale, video.default_duration, video.default_flags) == \
+        (b'vide', 90000, 3000, 0x00010000)
+    assert (audio.handler, audio.timescale, audio.default_duration) == (b'soun', 48000, 1024)
+
+
+def test_parse_init_reads_version_1_headers():
+    tracks = fmp4.parse_init(init_segment(trak(7, b'vide', 1000, version=1)))
+    assert tracks[7].timescale == 1000
+    assert tracks[7].handler == b'vide'
+
+
+def test_parse_init_without_moov():
+    assert fmp4.parse_init(box(b'ftyp', b'iso5')) == {}
+
+
+def test_parse_fragment_sums_the_video_sample_durations():
+    fragment = moof(traf(2, durations=[1024] * 94),
+                    traf(1, durations=[3000, 3000, 6000], first_flags=0x02000000))
+    duration, keyframe = fmp4.parse_fragment(fragment, TRACKS)
+    assert duration == 12000 / 90000
+    assert keyframe
+
+
+def test_parse_fragment_detects_a_fragment_not_starting_on_a_keyframe():
+    fragment = moof(traf(1, durations=[3000, 3000], first_flags=0x00010000))
+    assert fmp4.parse_fragment(fragment, TRACKS) == (6000 / 90000, False)
+
+
+def test_parse_fragment_reads_the_flags_of_the_first_sample():
+    fragment = moof(traf(1, durations=[3000, 3000], sample_flags=[0x02000000, 0x00010000]))
+    assert fmp4.parse_fragment(fragment, TRACKS)[1]
+
+
+def test_parse_fragment_falls_back_on_the_track_defaults():
+    # trex: 3000 per sample and non-sync samples
+    assert fmp4.parse_fragment(moof(traf(1, sample_flags=None)), TRACKS) == (3000 / 90000, False)
+    # tfhd defaults win over trex
+    fragment = moof(traf(1, default_duration=1500, default_flags=0x02000000))
+    assert fmp4.parse_fragment(fragment, TRACKS) == (1500 / 90000, True)
+
+
+def test_parse_fragment_of_audio_only_starts_on_a_keyframe():
+    duration, keyframe = fmp4.parse_fragment(moof(traf(2, durations=[1024, 1024])), TRACKS)
+    assert duration == 2048 / 48000
+    assert keyframe
+
+
+def test_parse_fragment_without_traf():
+    assert fmp4.parse_fragment(moof(), TRACKS) == (0.0, True)
+
+
+def test_read_stream_box_splits_a_stream():
+    large = u32(1) + b'mdat' + (16 + 5).to_bytes(8, 'big') + b'12345'
+    stream = io.BytesIO(box(b'ftyp', b'iso5') + box(b'moof', b'xy') + large)
+    assert fmp4.read_stream_box(stream) == (b'ftyp', box(b'ftyp', b'iso5'))
+    assert fmp4.read_stream_box(stream) == (b'moof', box(b'moof', b'xy'))
+    assert fmp4.read_stream_box(stream) == (b'mdat', large)
+    assert fmp4.read_stream_box(stream) == (None, b'')
+
+
+def test_read_stream_box_of_a_truncated_box():
+    assert fmp4.read_stream_box(io.BytesIO(box(b'mdat', b'12345')[:-1])) == (None, b'')
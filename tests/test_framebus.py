@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+from framebus import FrameBus, SharedCamera
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(f'test-{os.getpid()}-{uuid.uuid4().hex[:8]}', slots=4, slot_size=64, create=True)
+    yield bus
+    # Already closed by the tests of closing
+    if bus.shm.buf is not None:
+        bus.close()
+
+
+def test_write_then_read(bus):
+    assert bus.read() is None
+    bus.write(1, b'jpeg', width=2, height=1, channels=3)
+    seq, kind, width, height, channels, payload = bus.read()
+    assert (seq, width, height, channels, bytes(payload)) == (1, 2, 1, 3, b'jpeg')
+    assert bus.latest_seq == 1
+    del payload
+
+
+def test_reader_attaches_by_name(bus):
+    bus.write(1, b'frame')
+    reader = FrameBus(bus.name)
+    assert (reader.slots, reader.slot_size, reader.latest_seq) == (4, 64, 1)
+    assert bytes(reader.read(1)[5]) == b'frame'
+
+
+def test_a_reused_slot_is_not_current(bus):
+    bus.write(1, b'first')
+    payload = bus.read(1)[5]
+    assert bus.is_current(1)
+    # Same slot, the view now shows another frame
+    bus.write(5, b'fifth')
+    assert not bus.is_current(1)
+    assert bus.read(1) is None
+    assert bytes(payload) == b'fifth'
+    del payload
+
+
+def test_an_oversized_frame_is_refused(bus):
+    with pytest.raises(ValueError):
+        bus.write(1, bytes(65))
+    assert bus.latest_seq == 0
+
+
+def test_readers_see_the_bus_closed(bus):
+    reader = FrameBus(bus.name)
+    assert not reader.closed
+    bus.close()
+    assert reader.closed
+
+
+def test_a_segment_that_is_no_bus_is_refused(bus):
+    bus.shm.buf[0:4] = b'XXXX'
+    with pytest.raises(ValueError):
+        FrameBus(bus.name)
+    bus.shm.buf[0:4] = b'FBUS'
+
+
+def test_shared_camera_waits_for_the_next_frame(bus):
+    camera = SharedCamera(FrameBus(bus.name))
+    bus.write(1, b'one')
+    assert camera.wait_for_frame(1, 1) == 1
+    assert camera.wait_for_frame(2, 0.05) is None
+
+    threading.Timer(0.05, bus.write, (2, b'two')).start()
+    start = time.monotonic()
+    assert camera.wait_for_frame(2, 5) == 2
+    assert time.monotonic() - start < 1
+
+
+def test_shared_camera_viewers_end_when_the_bus_closes(bus):
+    camera = SharedCamera(FrameBus(bus.name))
+    threading.Timer(0.05, bus.close).start()
+    start = time.monotonic()
+    assert camera.wait_for_frame(1, 5) is None
+    assert time.monotonic() - start < 1
+    assert not camera.running
+
+
+def test_shared_camera_snapshot_is_read_again_when_torn(bus):
+    reader = FrameBus(bus.name)
+    camera = SharedCamera(reader)
+    bus.write(1, b'one')
+    checks = []
+
+    def is_current(seq):
+        checks.append(seq)
+        if len(checks) == 1:
+            # Overwritten during the copy
+            bus.write(2, b'two')
+            return False
+        return FrameBus.is_current(reader, seq)
+
+    reader.is_current = is_current
+    assert camera.get_encoded_frame() == (2, b'two')
+    assert checks == [1, 2]
@@ -0,0 +1,99 @@
+import logging
+import time
+
+import pytest
+
+from live_history import AdaptiveSchedule, LiveHistory, OFFLINE_CHECK_REQUESTS, DAY, HOUR
+from live_poller import Creator
+
+
+@pytest.fixture
+def schedule(tmp_path):
+    def schedule(**options):
+        return AdaptiveSchedule(logging.getLogger('test'), history=str(tmp_path / 'history.sqlite3'), **options)
+    return schedule
+
+
+def creators(count, live=0):
+    creators = {f'user{index}': Creator(f'user{index}') for index in range(count)}
+    for index in range(live):
+        creators[f'user{index}'].live = True
+    return creators
+
+
+def request_rate(schedule, creators):
+    return sum((1 if creators[user].live else OFFLINE_CHECK_REQUESTS) / interval
+               for user, interval in schedule.intervals.items())
+
+
+def test_start_rate_without_history(tmp_path):
+    history = LiveHistory(str(tmp_path / 'history.sqlite3'))
+    assert history.start_rate('nobody', time.time(), 2700) == 0.0
+
+
+def test_start_rate_is_higher_around_the_usual_start(tmp_path):
+    history = LiveHistory(str(tmp_path / 'history.sqlite3'))
+    now = time.time()
+    history.observe('evening', now - 28 * DAY)
+    for day in range(1, 28):
+        history.session_started('evening', now - day * DAY)
+    assert history.start_rate('evening', now, 2700) > 10 * history.start_rate('evening', now + 12 * HOUR, 2700)
+
+
+def test_history_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    now = time.time()
+    LiveHistory(path).session_started('user', now - HOUR)
+    assert LiveHistory(path).stats('user')['starts'] == 1
+
+
+def test_the_budget_is_a_ceiling(schedule):
+    few = creators(1)
+    adaptive = schedule(budget=0.5, prior=0.006, dense_rate=0.5, min_interval=30)
+    adaptive.plan(few, time.time())
+    # Polled from its own (prior) start rate, not as often as the budget allows
+    assert adaptive.intervals['user0'] == pytest.approx(30 * (0.5 / 0.006) ** 0.5)
+    assert adaptive.planned_rate < 0.5 / 10
+
+
+def test_many_creators_share_the_budget(schedule):
+    many = creators(100)
+    adaptive = schedule(budget=0.5)
+    adaptive.plan(many, time.time())
+    assert adaptive.planned_rate == pytest.approx(0.5, rel=1e-3)
+    assert request_rate(adaptive, many) == pytest.approx(0.5, rel=1e-3)
+    assert adaptive.stretch == 1
+
+
+def test_intervals_stretch_when_the_floor_exceeds_the_budget(schedule):
+    many = creators(500, live=20)
+    adaptive = schedule(budget=0.5, live_interval=60, max_interval=1200)
+    adaptive.plan(many, time.time())
+    assert adaptive.stretch > 1
+    assert request_rate(adaptive, many) == pytest.approx(0.5, rel=1e-3)
+    assert adaptive.intervals['user0'] == pytest.approx(60 * adaptive.stretch)
+    assert adaptive.intervals['user100'] == pytest.approx(1200 * adaptive.stretch)
+
+
+def test_a_creator_is_polled_densely_around_its_usual_start(schedule):
+    adaptive = schedule(min_interval=30, max_interval=1200)
+    now = time.time()
+    adaptive.history.observe('evening', now - 28 * DAY)
+    for day in range(1, 28):
+        adaptive.history.session_started('evening', now - day * DAY)
+    evening = {'evening': Creator('evening')}
+
+    adaptive.plan(evening, now)
+    assert adaptive.intervals['evening'] == 30
+    adaptive.plan(evening, now + 12 * HOUR)
+    assert 30 * 5 < adaptive.intervals['evening'] <= 1200
+
+
+def test_live_creators_are_polled_every_live_interval(schedule):
+    adaptive = schedule(live_interval=60)
+    creator = Creator('user')
+    adaptive.on_status(creator, False)
+    creator.live = True
+    adaptive.on_status(creator, True)
+    assert adaptive.intervals['user'] == 60
+    assert adaptive.history.stats('user')['starts'] == 1
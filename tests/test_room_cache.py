@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from room_cache import RoomCache, url_expiry
+
+
+@pytest.mark.parametrize('url, expiry', [
+    ('https://pull.example/stage/stream.flv?expire=1700000000&sign=abc', 1700000000.0),
+    ('https://pull.example/stream.flv?x-expires=1700000001', 1700000001.0),
+    ('https://pull.example/stream.flv?expires=1700000002', 1700000002.0),
+    ('https://pull.example/stream.flv?sign=abc', None),
+    ('https://pull.example/stream.flv?expire=soon', None),
+    ('https://pull.example/stream.flv', None),
+])
+def test_url_expiry(url, expiry):
+    assert url_expiry(url) == expiry
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RoomCache(path=str(tmp_path / 'cache.sqlite3'), room_ttl=60, url_ttl=600, refresh_margin=120)
+
+
+def test_room_ids_are_cached(cache):
+    assert cache.get_room_id('user') is None
+    cache.set_room_id('user', '42')
+    assert cache.get_room_id('user') == '42'
+
+
+def test_live_urls_are_kept_until_their_signed_expiry(cache):
+    cache.set_live_url('42', f'https://pull.example/a.flv?expire={int(time.time()) + 3600}')
+    assert cache.get_live_url('42').startswith('https://pull.example/a.flv')
+    # Expiring within refresh_margin counts as expired
+    cache.set_live_url('43', f'https://pull.example/b.flv?expire={int(time.time()) + 60}')
+    assert cache.get_live_url('43') is None
+
+
+def test_live_urls_without_expiry_are_kept_url_ttl(cache):
+    cache.set_live_url('42', 'https://pull.example/a.flv')
+    assert cache.get_live_url('42') == 'https://pull.example/a.flv'
+    cache.invalidate_live_url('42')
+    assert cache.get_live_url('42') is None
+
+
+def test_unwatched_rooms_are_not_refreshed(cache):
+    cache.watch('42', lambda: None)
+    cache.unwatch('42')
+    assert '42' not in cache.watched
@@ -0,0 +1,134 @@
+import socket
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+
+def serve(app, **options):
+    server = make_server('127.0.0.1', 0, app, threaded=True, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def connect():
+    servers = []
+
+    def connect(app, **options):
+        server = serve(app, **options)
+        servers.append(server)
+        sock = socket.create_connection(('127.0.0.1', server.port), timeout=5)
+        return sock, sock.makefile('rb')
+
+    yield connect
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def read_response(stream):
+    """
+    Read one response with a Content-Length body, return (head, body).
+    """
+    lines = []
+    while True:
+        line = stream.readline()
+        if line in (b'\r\n', b''):
+            break
+        lines.append(line)
+    head = b''.join(lines)
+    length = next(int(line.split(b':')[1]) for line in lines if line.lower().startswith(b'content-length'))
+    return head, stream.read(length)
+
+
+def closed(stream):
+    try:
+        return stream.read(1) == b''
+    except ConnectionResetError:
+        return True
+
+
+def ignore_body(environ, start_response):
+    body = environ['PATH_INFO'].encode()
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def test_keep_alive_drains_an_unread_body(connect):
+    sock, stream = connect(ignore_body, keep_alive=True)
+    sock.sendall(b'POST /first HTTP/1.1\r\nHost: x\r\nContent-Length: 11\r\n\r\nhello world'
+                 b'GET /second HTTP/1.1\r\nHost: x\r\n\r\n')
+    head, body = read_response(stream)
+    assert b'Connection: keep-alive' in head and body == b'/first'
+    head, body = read_response(stream)
+    assert head.startswith(b'HTTP/1.1 200') and body == b'/second'
+
+
+def test_keep_alive_drains_an_unread_chunked_body(connect):
+    sock, stream = connect(ignore_body, keep_alive=True)
+    sock.sendall(b'POST /first HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                 b'5\r\nhello\r\n0\r\n\r\n'
+                 b'GET /second HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert read_response(stream)[1] == b'/first'
+    assert read_response(stream)[1] == b'/second'
+
+
+def test_a_large_unread_body_closes_the_connection(connect):
+    sock, stream = connect(ignore_body, keep_alive=True)
+    sock.sendall(b'POST /first HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n' % (2 << 20))
+    assert read_response(stream)[1] == b'/first'
+    assert closed(stream)
+
+
+def test_connections_close_without_keep_alive(connect):
+    sock, stream = connect(ignore_body)
+    sock.sendall(b'GET /first HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert b'Connection: close' in read_response(stream)[0]
+    assert closed(stream)
+
+
+def test_an_application_error_closes_the_connection(connect):
+    def fail(environ, start_response):
+        raise RuntimeError('boom')
+
+    sock, stream = connect(fail, keep_alive=True)
+    # The unread body must never be taken for the next request
+    sock.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 35\r\n\r\n'
+                 b'GET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n')
+    head, _ = read_response(stream)
+    assert head.startswith(b'HTTP/1.1 500') and b'Connection: close' in head
+    assert closed(stream)
+
+
+def buffers_app(items):
+    def app(environ, start_response):
+        assert environ['werkzeug.scatter_gather']
+        start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+        return iter(items)
+    return app
+
+
+def read_chunked(stream):
+    while stream.readline() != b'\r\n':
+        pass
+    payload = b''
+    while True:
+        size = int(stream.readline(), 16)
+        if not size:
+            return payload
+        payload += stream.read(size)
+        assert stream.read(2) == b'\r\n'
+
+
+def test_a_sequence_of_buffers_is_written_as_one_chunk(connect):
+    sock, stream = connect(buffers_app([(b'--frame\r\n', memoryview(b'jpeg'), b'\r\n'), [b'a', b'', b'b']]))
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert read_chunked(stream) == b'--frame\r\njpeg\r\nab'
+
+
+def test_more_buffers_than_iov_max(connect):
+    buffers = [bytes([index % 256]) * 10 for index in range(3000)]
+    sock, stream = connect(buffers_app([buffers]))
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert read_chunked(stream) == b''.join(buffers)
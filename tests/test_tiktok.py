@@ -0,0 +1,15 @@
+from tiktok import parse_room_id, parse_is_live
+
+
+def test_parse_room_id():
+    page = '<html><meta property="al:android:url" content="snssdk1233://live?room_id=7301234567890"/></html>'
+    assert parse_room_id(page) == '7301234567890'
+
+
+def test_parse_room_id_without_live():
+    assert parse_room_id('<html><title>User</title></html>') is None
+
+
+def test_parse_is_live():
+    assert parse_is_live('{"data":{"liveRoom":{"status":2}}}')
+    assert not parse_is_live('{"data":{"liveRoom":{"status":4}}}')
@@ -1,32 +1,292 @@
-from threading import Thread
+from threading import Thread, Lock, Condition
 import cv2
+import logging
+import os
+import random
 import time
 
+STATE_IDLE = 'idle'
+STATE_STREAMING = 'streaming'
+STATE_RECONNECTING = 'reconnecting'
+
 
 class ThreadedCamera(object):
-    def __init__(self, src=0):
-        self.capture = cv2.VideoCapture(src)
-        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 2)
-        self.original_width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.original_height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    def __init__(self, src=0, renditions=None, lazy=False, idle_timeout=None, stall_timeout=5, max_backoff=30,
+                 logger=None):
+        self.logger = logger or logging.getLogger('logger')
+        # src is either the stream url, or a callable(refresh) returning it,
+        # called with refresh=True when the returned url cannot be opened
+        # or when the upstream dropped
+        self.src = src
+        self.capture = None
+        self.original_width = 0
+        self.original_height = 0
         self.frame = None
+        self.frame_seq = 0
+        self.grabbed = 0
+        # Tells the sequence numbers of this camera from the ones of another
+        # camera or process, e.g. in the snapshot ETags
+        self.epoch = os.urandom(4).hex()
         self.FPS = 1 / 50
         self.FPS_MS = int(self.FPS * 1000)
 
+        # Notified every time a new frame is published
+        self.condition = Condition()
+
+        # Rendition ladder (frame heights), None being the source resolution.
+        # Each rendition has its own encoded-frame slot shared by all its viewers.
+        self.renditions = sorted(set(renditions or []), reverse=True)
+        self.subscribers = {height: 0 for height in [None] + self.renditions}
+        self.encode_locks = {height: Lock() for height in self.subscribers}
+        self.encoded = {height: (0, b'', b'') for height in self.subscribers}
+
+        # Frame intervals (skip_frames) requested by the subscribers, the
+        # smallest one drives how often a grabbed frame is actually decoded
+        self.frame_intervals = {}
+
+        # The upstream is released after idle_timeout seconds without subscribers
+        # and opened again by the next subscriber. A lazy camera opens it on
+        # the first subscriber only.
+        self.idle_timeout = idle_timeout
+        self.idle_since = time.monotonic()
+        self.running = True
+
+        # Reconnect state machine: no grabbed frame for stall_timeout seconds
+        # means the upstream dropped, it is reopened with exponential backoff
+        self.state = STATE_IDLE
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+        self.backoff = 1
+        self.last_grab = time.monotonic()
+        self.reconnecting_since = None
+        self.reconnects = 0
+        self.last_reconnect_time = 0.0
+
+        # Optional shared-memory frame bus the encoded frames of one rendition
+        # are written to, for HTTP workers running in other processes
+        self.bus = None
+        self.bus_rendition = None
+        self.bus_skip_frames = 1
+        self.bus_lock = Lock()
+
+        # Callables(seq) called from the capture thread on every published frame
+        self.listeners = []
+
+        if not lazy:
+            self.open()
+
         # Start frame retrieval thread
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
         self.thread.start()
 
+    def open(self, refresh=False):
+        if callable(self.src):
+            self.capture = self.open_capture(self.src(refresh))
+            if not self.capture.isOpened() and not refresh:
+                # The cached url may have expired, ask for a fresh one
+                self.capture = self.open_capture(self.src(True))
+        else:
+            self.capture = self.open_capture(self.src)
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 2)
+        self.original_width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.original_height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.last_grab = time.monotonic()
+        if self.state == STATE_IDLE:
+            self.state = STATE_STREAMING
+
+    def open_capture(self, src):
+        if src is None:
+            # No url available right now, the reconnect loop will try again
+            return cv2.VideoCapture()
+        # Bound the blocking open/grab calls so a stalled upstream is noticed
+        timeout_ms = int(self.stall_timeout * 1000)
+        return cv2.VideoCapture(src, cv2.CAP_ANY, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+                                                   cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms])
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+        with self.condition:
+            # Never serve a frame from before the upstream was released
+            self.frame = None
+            for rendition in self.encoded:
+                self.encoded[rendition] = (0, b'', b'')
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def is_idle(self):
+        with self.condition:
+            return (self.idle_timeout is not None and not self.frame_intervals
+                    and time.monotonic() - self.idle_since > self.idle_timeout)
+
     def update(self):
-        while True:
-            if self.capture.isOpened():
-                (self.status, self.frame) = self.capture.read()
+        while self.running:
+            if self.capture is None:
+                # Hibernating, wait for a subscriber before opening the upstream
+                with self.condition:
+                    self.condition.wait_for(lambda: self.frame_intervals or not self.running)
+                if not self.running:
+                    break
+                self.open()
+            elif self.is_idle():
+                self.logger.info("ThreadedCamera: no viewers, releasing the upstream connection")
+                self.close()
+                self.state = STATE_IDLE
+                continue
+
+            # grab() keeps up with the stream, only the frames some
+            # subscriber will be served are decoded with retrieve()
+            self.status = self.capture.isOpened() and self.capture.grab()
+            if self.status:
+                self.last_grab = time.monotonic()
+                if self.state == STATE_RECONNECTING:
+                    self.reconnected()
+                self.grabbed += 1
+                if self.needs_frame():
+                    (self.status, frame) = self.capture.retrieve()
+                    if self.status:
+                        self.publish(frame)
+            elif not self.capture.isOpened() or time.monotonic() - self.last_grab > self.stall_timeout:
+                self.reconnect()
+                continue
             time.sleep(self.FPS)
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 self.capture.release()
                 cv2.destroyAllWindows()
                 break
+        self.close()
+
+    def reconnect(self):
+        """
+        Reopen the upstream with a freshly fetched url. Subscribers stay
+        attached and resume on the first frame grabbed after the reconnect.
+        """
+        if self.state != STATE_RECONNECTING:
+            self.logger.error(f"ThreadedCamera: no frame for {self.stall_timeout}s, reconnecting")
+            self.state = STATE_RECONNECTING
+            self.reconnecting_since = time.monotonic()
+            self.backoff = 1
+        else:
+            time.sleep(self.backoff + random.uniform(0, self.backoff / 2))
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+        self.capture.release()
+        self.open(refresh=True)
+
+    def reconnected(self):
+        self.state = STATE_STREAMING
+        self.reconnects += 1
+        self.last_reconnect_time = time.monotonic() - self.reconnecting_since
+        self.logger.info(f"ThreadedCamera: reconnected in {self.last_reconnect_time:.1f}s")
+
+    def stats(self):
+        with self.condition:
+            return {
+                "state": self.state,
+                "grabbed": self.grabbed,
+                "frame_seq": self.frame_seq,
+                "subscribers": sum(self.subscribers.values()),
+                "reconnects": self.reconnects,
+                "last_reconnect_time": round(self.last_reconnect_time, 3),
+            }
+
+    def needs_frame(self):
+        """
+        Whether the last grabbed frame is due to at least one subscriber.
+        """
+        with self.condition:
+            if not self.frame_intervals:
+                return False
+            return not self.frame_seq or self.grabbed >= self.frame_seq + min(self.frame_intervals)
+
+    def publish(self, frame):
+        """
+        Store a freshly decoded frame, tagged with its upstream frame number.
+        """
+        with self.condition:
+            self.frame = frame
+            self.frame_seq = self.grabbed
+            self.condition.notify_all()
+
+        for listener in self.listeners:
+            listener(self.frame_seq)
+
+        with self.bus_lock:
+            if self.bus is not None:
+                seq, frame_bytes, _ = self.get_encoded_part(self.bus_rendition)
+                try:
+                    self.bus.write(seq, frame_bytes)
+                except ValueError as ex:
+                    # A frame too large for a slot is skipped, the capture goes on
+                    self.logger.error(f"ThreadedCamera: {ex}")
+
+    def attach_bus(self, bus, rendition=None, skip_frames=1):
+        """
+        Publish every skip_frames-th frame of rendition, JPEG encoded, on a FrameBus.
+        The bus counts as a subscriber, so the capture never hibernates while attached.
+        """
+        self.bus_rendition = rendition
+        self.bus_skip_frames = skip_frames
+        self.subscribe(rendition, skip_frames)
+        with self.bus_lock:
+            self.bus = bus
+
+    def detach_bus(self):
+        """
+        Stop publishing on the frame bus and return it, no frame is being
+        written to it anymore once this returns.
+        """
+        with self.bus_lock:
+            bus, self.bus = self.bus, None
+        if bus is not None:
+            self.unsubscribe(self.bus_rendition, self.bus_skip_frames)
+        return bus
+
+    def wait_for_frame(self, min_seq, timeout=None):
+        """
+        Block until a frame with a sequence number >= min_seq is published.
+        Return the latest sequence number, or None if the timeout expired first.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frame is not None and self.frame_seq >= min_seq, timeout):
+                return None
+            return self.frame_seq
+
+    def select_rendition(self, height):
+        """
+        Map a requested frame height to a rendition of the ladder: the largest
+        one not above the request, or the smallest one if the request is below
+        them all. None, or a height at or above the source, means the source.
+        """
+        if height is None or not self.renditions or height >= self.original_height > 0:
+            return None
+        for rendition in self.renditions:
+            if rendition <= height:
+                return rendition
+        return self.renditions[-1]
+
+    def subscribe(self, rendition=None, skip_frames=1):
+        with self.condition:
+            self.subscribers[rendition] += 1
+            self.frame_intervals[skip_frames] = self.frame_intervals.get(skip_frames, 0) + 1
+            # Wakes up a hibernating capture thread
+            self.condition.notify_all()
+
+    def unsubscribe(self, rendition=None, skip_frames=1):
+        with self.condition:
+            self.frame_intervals[skip_frames] -= 1
+            if self.frame_intervals[skip_frames] == 0:
+                del self.frame_intervals[skip_frames]
+                if not self.frame_intervals:
+                    self.idle_since = time.monotonic()
+            # The encoded frame of a rendition nobody watches anymore is kept,
+            # it is the first frame of its next viewer
+            self.subscribers[rendition] -= 1
 
     def show_frame(self):
         cv2.imshow('frame', self.frame)
@@ -34,9 +294,60 @@ class ThreadedCamera(object):
             self.capture.release()
             cv2.destroyAllWindows()
 
-    def get_frame(self):
-        if self.frame is not None:
-            _, jpeg = cv2.imencode('.jpg', cv2.resize(self.frame, (self.original_width, self.original_height)))
-            return jpeg.tobytes()
-        else:
-            return b''
+    def get_encoded_frame(self, rendition=None):
+        """
+        Return (sequence number, jpeg bytes) of the latest frame at the given rendition.
+        Each decoded frame is scaled and encoded at most once per rendition,
+        whatever the number of viewers.
+        """
+        seq, frame_bytes, _ = self.get_encoded_part(rendition)
+        return seq, frame_bytes
+
+    def get_ready_part(self, rendition=None):
+        """
+        Return the last encoded (sequence number, jpeg bytes, part header) of
+        rendition without waiting nor encoding, for the first frame of a new viewer.
+        Falls back to the freshest other rendition, (0, b'', b'') when none is encoded.
+        """
+        encoded = self.encoded[rendition]
+        if not encoded[0]:
+            encoded = max(self.encoded.values(), key=lambda part: part[0])
+        return encoded
+
+    def is_current(self, seq):
+        """
+        Whether the jpeg of frame seq is still intact once sent, always true
+        here: encoded frames are immutable bytes, unlike the frame bus slots.
+        """
+        return True
+
+    def get_encoded_part(self, rendition=None):
+        """
+        Return (sequence number, jpeg bytes, multipart part header) of the latest frame.
+        The part header carries the Content-Length of the jpeg and is built
+        once per encoded frame, along with it.
+        """
+        with self.condition:
+            frame, seq = self.frame, self.frame_seq
+
+        if frame is None:
+            return 0, b'', b''
+
+        with self.encode_locks[rendition]:
+            encoded = self.encoded[rendition]
+            if encoded[0] < seq:
+                if rendition is not None and rendition < frame.shape[0]:
+                    width = int(frame.shape[1] * rendition / frame.shape[0]) // 2 * 2
+                    frame = cv2.resize(frame, (width, rendition), interpolation=cv2.INTER_AREA)
+                _, jpeg = cv2.imencode('.jpg', frame)
+                frame_bytes = jpeg.tobytes()
+                part_header = (b'--frame\r\n'
+                               b'Content-Type: image/jpeg\r\n'
+                               b'Content-Length: %d\r\n\r\n' % len(frame_bytes))
+                encoded = (seq, frame_bytes, part_header)
+                self.encoded[rendition] = encoded
+            return encoded
+
+    def get_frame(self, rendition=None):
+        _, frame_bytes = self.get_encoded_frame(rendition)
+        return frame_bytes
@@ -5,40 +5,41 @@ import errors
 import re
 from errors import Error, TimeOut
 import cv2
-from httpclient import HttpClient
-from flask import Flask, Response
-import threading
 from threadedCamera import ThreadedCamera
 
+ROOM_ID_PATTERN = re.compile("room_id=(.*?)\"/>")
 
-def generate_frames(threaded_camera, skip_frames):
-    """
-    Generate frames for streaming.
-    """
-    try:
-        while True:
-            frame_bytes = threaded_camera.get_frame()
 
-            if not frame_bytes:
-                # If frame is not available, yield an empty frame
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n\r\n\r\n')
-                continue
+def room_url(user):
+    return f"https://www.tiktok.com/@{user}/live"
 
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n\r\n')
 
-            time.sleep(skip_frames * threaded_camera.FPS)
+def live_detail_url(room_id):
+    return f"https://www.tiktok.com/api/live/detail/?aid=1988&roomID={room_id}"
 
-    except Exception as e:
-        # Log any exceptions that might occur during frame generation
-        print(f"Error in generate_frames: {e}")
+
+def parse_room_id(content):
+    """
+    Room id of the current (or last) live in a user live page, None if there is none.
+    """
+    match = ROOM_ID_PATTERN.search(content)
+    return match.group(1) if match else None
+
+
+def parse_is_live(content):
+    """
+    Whether an api/live/detail response describes a room that is live.
+    """
+    return '"status":4' not in content
 
 
 class TikTok:
 
-    def __init__(self, httpclient, logger, room_id=None, user=None, url=None):
+    def __init__(self, httpclient, logger, room_id=None, user=None, url=None, cache=None):
         self.camera = None
+        self.live_url = None
+        # Optional RoomCache of the room ids and pull urls
+        self.cache = cache
         self.logger = logger
         self.room_id = room_id
         self.user = user
@@ -48,40 +49,17 @@ class TikTok:
         else:
             self.httpclient = req
 
+        if self.room_id is None and self.cache is not None:
+            self.room_id = self.cache.get_room_id(self.user)
+
         if self.room_id is None:
             self.room_id = self.get_room_id_from_user()
+            if self.cache is not None:
+                self.cache.set_room_id(self.user, self.room_id)
 
         self.logger.info(f"USERNAME: {self.user}")
         self.logger.info(f"ROOM_ID:  {self.room_id}")
 
-        # I create a new httpclient without proxy
-        self.httpclient = HttpClient(self.logger).req
-
-    def run(self):
-        """
-        running the application
-        checking if the user is live at the moment
-            if yes starting to display the stream
-            if no just print user is not live at the moment
-        """
-        if not self.is_user_in_live():
-            self.logger.info(f"{self.user} is not live at the moment ")
-        else:
-            self.logger.info(f"{self.user} is live, we can get the stream this is the chanel if {self.room_id}")
-            threading.Thread(target=self.start_flask_app).start()
-
-    def start_flask_app(self):
-        app = Flask(__name__)
-        threaded_camera = ThreadedCamera(self.get_live_url())
-
-        @app.route('/')
-        def index():
-            return Response(generate_frames(threaded_camera, 5),
-                            mimetype='multipart/x-mixed-replace; boundary=frame')
-
-        app.run(host='0.0.0.0', port=5000, debug=False)
-
-
     # def use_threaded_camera(self):
     #     live_url = self.get_live_url()
     #     threaded_camera = ThreadedCamera(live_url)
@@ -104,7 +82,8 @@ class TikTok:
         self.logger.info("STARTED STREAMING...")
 
         try:
-            self.camera = ThreadedCamera(live_url)
+            self.camera = ThreadedCamera(live_url, logger=self.logger)
+            self.camera.subscribe()
 
             frame_counter = 0
             while True:
@@ -119,9 +98,6 @@ class TikTok:
         except KeyboardInterrupt:
             pass
         finally:
-            if self.httpclient:
-                self.httpclient.close()
-                self.logger.info("HTTP session closed")
             if self.camera:
                 self.camera.capture.release()
                 cv2.destroyAllWindows()
@@ -161,27 +137,44 @@ class TikTok:
         """
         Given a username, I get the room_id
         """
-        try:
-            response = self.httpclient.get(f"https://www.tiktok.com/@{self.user}/live", allow_redirects=False)
-            if response.status_code == 302:
-                raise errors.Blacklisted('Redirect')
-
-            content = response.text
-            if "room_id" not in content:
-                raise ValueError()
-
-            return re.findall("room_id=(.*?)\"/>", content)[0]
-        except (req.HTTPError, errors.Blacklisted) as e:
-            raise errors.Blacklisted(Error.BLACKLIST_ERROR)
-        except ValueError:
-            self.logger.error(f"Unable to find room_id. I'll try again in {TimeOut.CONNECTION_CLOSED} minutes")
-            time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
-            return self.get_room_id_from_user()
-        except AttributeError:
+        while True:
+            try:
+                response = self.httpclient.get(room_url(self.user), allow_redirects=False)
+                if response.status_code == 302:
+                    raise errors.Blacklisted('Redirect')
+
+                room_id = parse_room_id(response.text)
+                if room_id is not None:
+                    return room_id
+                self.logger.error(f"Unable to find room_id. I'll try again in {TimeOut.CONNECTION_CLOSED} minutes")
+            except (req.HTTPError, errors.Blacklisted) as e:
+                raise errors.Blacklisted(Error.BLACKLIST_ERROR)
+            except AttributeError:
+                pass
+            except Exception as ex:
+                self.logger.error(ex)
+                exit(1)
             time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
-        except Exception as ex:
-            self.logger.error(ex)
-            exit(1)
+
+    def cached_live_url(self, refresh=False) -> str:
+        """
+        Return the last live url fetched, or fetch a new one.
+        With a RoomCache, the url survives restarts and is kept fresh in the background.
+        """
+        if self.cache is None:
+            if refresh or not self.live_url:
+                self.live_url = self.get_live_url()
+            return self.live_url
+
+        if refresh:
+            self.cache.invalidate_live_url(self.room_id)
+        self.live_url = self.cache.get_live_url(self.room_id)
+        if not self.live_url:
+            self.live_url = self.get_live_url()
+            self.cache.set_live_url(self.room_id, self.live_url)
+        if self.live_url:
+            self.cache.watch(self.room_id, self.get_live_url)
+        return self.live_url
 
     def get_live_url(self) -> str:
         """
@@ -209,10 +202,9 @@ class TikTok:
         """
         self.logger.info(f"checking if {self.user} user is live")
         try:
-            url = f"https://www.tiktok.com/api/live/detail/?aid=1988&roomID={self.room_id}"
-            content = self.httpclient.get(url).text
+            content = self.httpclient.get(live_detail_url(self.room_id)).text
 
-            return '"status":4' not in content
+            return parse_is_live(content)
         except ConnectionAbortedError:
             self.logger.error(Error.CONNECTION_CLOSED_AUTOMATIC)
             time.sleep(TimeOut.CONNECTION_CLOSED * TimeOut.ONE_MINUTE)
@@ -0,0 +1,97 @@
+import time
+from threading import Lock
+
+
+class Viewer:
+    """
+    Latest-frame-wins mailbox of a single MJPEG client.
+    The client only ever picks the newest published frame, the frames it
+    could not keep up with are counted as dropped instead of being queued.
+    """
+
+    def __init__(self, address, rendition=None, skip_frames=1):
+        self.address = address
+        self.rendition = rendition
+        self.skip_frames = skip_frames
+        self.connected_at = time.monotonic()
+        self.last_seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.behind_since = None
+        self.evicted = False
+
+    def next_seq(self):
+        """
+        Sequence number of the next frame due to this client.
+        """
+        return self.last_seq + self.skip_frames if self.last_seq else 1
+
+    def is_behind(self, latest_seq):
+        """
+        Update the lag state of the client once its previous frame is written.
+        The client is behind when a frame newer than its due one already exists.
+        """
+        if self.last_seq and latest_seq is not None and latest_seq > self.next_seq():
+            if self.behind_since is None:
+                self.behind_since = time.monotonic()
+        else:
+            self.behind_since = None
+        return self.behind_since is not None
+
+    def lag(self):
+        if self.behind_since is None:
+            return 0.0
+        return time.monotonic() - self.behind_since
+
+    def deliver(self, seq):
+        """
+        Record that the frame seq is sent to the client.
+        """
+        if self.last_seq:
+            self.dropped += max(0, seq - self.next_seq()) // self.skip_frames
+        self.last_seq = seq
+        self.sent += 1
+
+    def stats(self):
+        return {
+            "address": self.address,
+            "rendition": self.rendition,
+            "connected_for": round(time.monotonic() - self.connected_at, 3),
+            "last_seq": self.last_seq,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "lag": round(self.lag(), 3),
+        }
+
+
+class ViewerRegistry:
+    """
+    Keeps track of the connected clients and evicts the ones that stay
+    behind for longer than the configured timeout.
+    """
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.viewers = set()
+        self.evicted = 0
+        self.lock = Lock()
+
+    def add(self, viewer):
+        with self.lock:
+            self.viewers.add(viewer)
+
+    def remove(self, viewer):
+        with self.lock:
+            self.viewers.discard(viewer)
+            if viewer.evicted:
+                self.evicted += 1
+
+    def should_evict(self, viewer):
+        if self.timeout and viewer.lag() > self.timeout:
+            viewer.evicted = True
+        return viewer.evicted
+
+    def stats(self):
+        with self.lock:
+            viewers = [viewer.stats() for viewer in self.viewers]
+        return {"count": len(viewers), "evicted": self.evicted, "viewers": viewers}